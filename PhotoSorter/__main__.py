@@ -1,9 +1,42 @@
 from . import __version__
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+import sys
+
 from . import main_log
+from . import profiling
+from .progress import Progress
 
 log = main_log.getChild(__name__)
 
+PROFILE = "--profile" in sys.argv[1:]
+"""Whether to profile the run, to find out where the time goes"""
+
+
+@contextmanager
+def tracked(progress: Progress, summarise: bool = True):
+    """Summarise the progress of sorting once it's done, and profile it if
+    PhotoSorter was run with ``--profile``."""
+
+    with profiling.profiled(progress) if PROFILE else nullcontext():
+        with progress if summarise else nullcontext():
+            yield
+
+
+def ask_output() -> str:
+    """Ask how sorted files should be put into the sorted tree."""
+
+    from .transfer import OUTPUT_MODES
+
+    while True:
+        output = input(f"Output mode ({', '.join(OUTPUT_MODES)}) [move]: ").strip()
+        if not output:
+            return "move"
+        if output in OUTPUT_MODES:
+            return output
+
+        print("Unknown output mode")
+
 
 def sort_on_disk():
     """Sort photos on a physical file system."""
@@ -13,8 +46,81 @@ def sort_on_disk():
 
     in_path = input("Photos Location: ")
     out_path = input("Sorted Location: ")
+    output = ask_output()
+
+    progress = Progress()
+    with tracked(progress):
+        disk_sorter.move_photos(
+            Path(in_path), Path(out_path), progress=progress, output=output
+        )
+
 
-    disk_sorter.move_photos(Path(in_path), Path(out_path))
+def plan_on_disk():
+    """Plan how to sort photos on a physical file system, without moving them."""
+
+    from pathlib import Path
+    from . import disk_sorter, plan
+
+    in_path = input("Photos Location: ")
+    out_path = input("Sorted Location: ")
+    plan_path = input("Plan file to write: ")
+
+    progress = Progress()
+    with tracked(progress, summarise=False):
+        moves = disk_sorter.plan_moves(Path(in_path), Path(out_path), progress=progress)
+        plan.write_plan(moves, plan_path)
+
+
+def execute_disk_plan():
+    """Sort photos on a physical file system according to a saved plan."""
+
+    from pathlib import Path
+    from . import disk_sorter, plan
+
+    plan_path = input("Plan file to execute: ")
+    out_path = input("Sorted Location: ")
+
+    progress = Progress(total=plan.count_moves(plan_path))
+    with tracked(progress):
+        disk_sorter.execute_plan(
+            plan.read_plan(plan_path), Path(out_path), progress=progress
+        )
+
+
+def watch_on_disk():
+    """Keep photos on a physical file system sorted, sorting new photos as
+    they arrive."""
+
+    from pathlib import Path
+    from . import watch
+
+    in_path = input("Photos Location: ")
+    out_path = input("Sorted Location: ")
+    output = ask_output()
+
+    print("Watching for new photos. Press Ctrl+C to stop.")
+
+    progress = Progress()
+    with tracked(progress):
+        try:
+            watch.watch(Path(in_path), Path(out_path), progress=progress, output=output)
+        except KeyboardInterrupt:
+            log.info("Stopped watching")
+
+
+def sort_archive_on_disk():
+    """Sort photos out of a zip or tar archive on a physical file system,
+    without extracting it first."""
+
+    from pathlib import Path
+    from . import archive
+
+    archive_path = input("Archive Location: ")
+    out_path = input("Sorted Location: ")
+
+    progress = Progress()
+    with tracked(progress):
+        archive.sort_archive(archive_path, Path(out_path), progress=progress)
 
 
 def sort_on_onedrive():
@@ -36,24 +142,37 @@ def sort_on_onedrive():
     log.info("Beginning sorting")
     start = datetime.now()
 
-    drive_sorter.sort_photos(graph, in_path, out_path)
+    progress = Progress()
+    with tracked(progress):
+        drive_sorter.sort_photos(graph, in_path, out_path, progress=progress)
 
     end = datetime.now()
     log.info("Sorting finished")
-    log.info(f"Total requests: {graph.total_requests_made}")
+    log.info("Total requests: %s", graph.total_requests_made)
 
     delta = end - start
-    log.info(f"Duration: {delta}")
+    log.info("Duration: %s", delta)
 
 
 # Main code
+from . import logs
+
+logs.configure()
+
 print(f"PhotoSorter version {__version__}")
 
-print(f"0 - Sort Photos on local disk\n1 - Sort Photos on OneDrive")
+print(
+    "0 - Sort Photos on local disk\n"
+    "1 - Sort Photos on OneDrive\n"
+    "2 - Plan sorting Photos on local disk\n"
+    "3 - Execute a plan for sorting Photos on local disk\n"
+    "4 - Watch a folder on local disk and sort new Photos as they arrive\n"
+    "5 - Sort Photos out of a zip or tar archive on local disk"
+)
 while True:
     try:
         choice = int(input("> "))
-        if choice not in [0, 1]:
+        if choice not in [0, 1, 2, 3, 4, 5]:
             raise ValueError()
         break
     except ValueError:
@@ -62,5 +181,13 @@ while True:
 
 if choice == 0:
     sort_on_disk()
-else:
+elif choice == 1:
     sort_on_onedrive()
+elif choice == 2:
+    plan_on_disk()
+elif choice == 3:
+    execute_disk_plan()
+elif choice == 4:
+    watch_on_disk()
+else:
+    sort_archive_on_disk()
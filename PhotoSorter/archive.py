@@ -0,0 +1,325 @@
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, Set
+import itertools
+import os
+import secrets
+import shutil
+import tarfile
+import zipfile
+import zlib
+
+from . import main_log
+from . import exif
+from . import probe
+from . import sniff
+from . import timestamps
+from .destination import DestinationIndex
+from .progress import Progress
+from .walker import compile_patterns
+
+logging = main_log.getChild(__name__)
+
+ARCHIVE_EXTENSIONS = (
+    ".zip",
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.xz",
+    ".txz",
+)
+"""Extensions of the archives photos can be sorted straight out of"""
+
+BUFFER_SIZE = 8 * 1024 * 1024
+"""Size of the reads made when writing a member out of an archive"""
+
+# Errors meaning a member of an archive is corrupt, which only that member is
+# skipped for
+_CORRUPT = (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError)
+
+ArchiveMember = namedtuple("ArchiveMember", ["name", "size", "mtime", "file"])
+"""A file in an archive.
+
+``name`` is the path of the file within the archive, ``size`` its size in
+bytes, ``mtime`` its modification time as a POSIX timestamp and ``file`` a
+file object to read it from. ``file`` can only be read until the next member is
+asked for.
+"""
+
+
+def is_archive(path: str | os.PathLike) -> bool:
+    """Tell whether a path is named like an archive that can be sorted.
+
+    Args:
+        path: The path
+    """
+    return os.fspath(path).lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def members(path: str | os.PathLike) -> Iterator[ArchiveMember]:
+    """Read the files in a zip or tar archive, in the order they're stored.
+
+    Tar archives, compressed or not, are read as a stream, and the members of
+    zip archives are read in the order of their offsets, so either way the
+    archive is read from start to end exactly once. Directories, links and
+    other special members are left out.
+
+    Args:
+        path: The archive
+
+    Raises:
+        OSError: If the archive can't be read
+        ValueError: If the file isn't a zip or tar archive
+    """
+    if zipfile.is_zipfile(path):
+        # For entries without a valid date
+        archive_mtime = os.stat(path).st_mtime
+
+        with zipfile.ZipFile(path) as archive:
+            infos = sorted(archive.infolist(), key=lambda info: info.header_offset)
+            for info in infos:
+                if info.is_dir():
+                    continue
+
+                try:
+                    mtime = datetime(*info.date_time).timestamp()
+                except ValueError:
+                    # e.g. a zeroed date, which reads as month 0 of 1980
+                    mtime = archive_mtime
+
+                with archive.open(info) as f:
+                    yield ArchiveMember(info.filename, info.file_size, mtime, f)
+        return
+
+    try:
+        archive = tarfile.open(path, mode="r|*")
+    except tarfile.ReadError as err:
+        raise ValueError("Not a zip or tar archive", os.fspath(path)) from err
+
+    with archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+
+            with archive.extractfile(info) as f:
+                yield ArchiveMember(info.name, info.size, info.mtime, f)
+
+
+def _header_timestamp(header: bytes) -> datetime | None:
+    # Most photos have their EXIF metadata at the very start, so they can be
+    # dated before they are even written out
+    try:
+        dates = exif.read_dates(header)
+    except exif.ExifError:
+        return None
+
+    timestamp = dates.get(exif.DATETIME) or dates.get(exif.DATETIME_ORIGINAL)
+    try:
+        return timestamps.parse_exif(timestamp) if timestamp else None
+    except ValueError:
+        return None
+
+
+def _write(member: ArchiveMember, header: bytes, directory: str) -> str:
+    # Writes the member to a temporary file in the sorted tree, so that it can
+    # be renamed into place
+    name = os.path.basename(member.name)
+
+    # Created with the usual permissions, unlike with tempfile
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    while True:
+        temp = os.path.join(directory, f".{name}.{secrets.token_hex(4)}.partial")
+        try:
+            fd = os.open(temp, flags, 0o666)
+            break
+        except FileExistsError:
+            continue
+
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            f.write(header)
+            shutil.copyfileobj(member.file, f, BUFFER_SIZE)
+            os.fsync(f.fileno())
+
+        os.utime(temp, (member.mtime, member.mtime))
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+    return temp
+
+
+def _free_name(index: DestinationIndex, year: str, month: str, name: str) -> str:
+    stem, ext = os.path.splitext(name)
+    for n in itertools.count(1):
+        if not index.contains(year, month, name):
+            return name
+        name = f"{stem} ({n}){ext}"
+
+
+def _skip(member: ArchiveMember, reason: str, progress: Progress, temp=None):
+    logging.warning("Skipping %s: %s", member.name, reason)
+    progress.add_skipped(reason)
+    if temp:
+        os.unlink(temp)
+
+
+def _extract(
+    member: ArchiveMember,
+    name: str,
+    out: Path,
+    index: DestinationIndex,
+    rename: bool,
+    progress: Progress,
+) -> str | None:
+    # Sorts one member, returning the folder it went into, if any
+    with progress.stage("probe"):
+        header = member.file.read(exif.HEADER_SIZE)
+
+        if sniff.sniff(header[: sniff.SNIFF_SIZE]) == "other":
+            logging.debug("Skipping %s: %s", member.name, probe.NOT_MEDIA)
+            progress.add_skipped(probe.NOT_MEDIA)
+            return None
+
+        try:
+            timestamp = timestamps.parse_filename(name)
+        except ValueError:
+            timestamp = _header_timestamp(header)
+
+    reason = "already exists at out directory"
+
+    # Don't write out what would only be thrown away
+    if timestamp and not rename:
+        if index.contains(f"{timestamp.year:0>4}", f"{timestamp.month:0>2}", name):
+            _skip(member, reason, progress)
+            return None
+
+    with progress.stage("write"):
+        try:
+            temp = _write(member, header, out)
+        except OSError as err:
+            logging.error("Failed to write %s. Skipping.", member.name)
+            logging.error("%s", err)
+            progress.add_failed()
+            return None
+
+    if timestamp is None:
+        with progress.stage("probe"):
+            result = probe.probe_file(temp)
+
+        if result.reason:
+            _skip(member, result.reason, progress, temp)
+            return None
+
+        timestamp = result.timestamp
+
+    year = f"{timestamp.year:0>4}"
+    month = f"{timestamp.month:0>2}"
+
+    if index.contains(year, month, name) and not rename:
+        _skip(member, reason, progress, temp)
+        return None
+
+    name = _free_name(index, year, month, name)
+    with progress.stage("move"):
+        try:
+            os.replace(temp, index.folder(year, month) / name)
+        except OSError as err:
+            logging.error("Failed to move %s into place. Skipping.", member.name)
+            logging.error("%s", err)
+            progress.add_failed()
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            return None
+    index.add(year, month, name)
+
+    logging.debug("Sorted %s into %s/%s", member.name, year, month)
+    progress.add_moved(member.size)
+    return f"{year}/{month}"
+
+
+def sort_archive(
+    archive: str | os.PathLike,
+    out: Path,
+    rename: bool = False,
+    progress: Progress | None = None,
+    include: Iterable[str] | None = None,
+    exclude: Iterable[str] | None = None,
+) -> Set[str]:
+    """Sort the photos in a zip or tar archive, such as a Google Takeout export,
+    without extracting it first.
+
+    The archive is read once, from start to end. Each photo or video is
+    written straight into its folder in the sorted tree, so no more space is
+    needed than the sorted photos take up. Members are dated from their names
+    or from the EXIF metadata at the start of their data where possible, and
+    are otherwise probed once written out, which is needed e.g. for videos
+    with their metadata at the end. Other members and members that can't be
+    dated are left in the archive.
+
+    Args:
+        archive: The archive
+        out: The out directory to put the sorted file tree
+        rename: Whether to give photos a new name, e.g. ``IMG_0001 (1).JPG``,
+            when a file with the same name is already in the sorted tree.
+            Otherwise they are skipped.
+        progress: Tracks how sorting is going. If None, a summary is logged
+            once sorting is done.
+        include: Shell-style patterns of the file names to sort. All files are
+            considered if None.
+        exclude: Shell-style patterns of file names to ignore
+
+    Returns:
+        The folders of the sorted tree that photos were written into, like
+        ``"2019/07"``
+
+    Raises:
+        OSError: If the archive can't be read
+        ValueError: If ``out`` isn't a directory, or ``archive`` isn't an
+            archive
+    """
+    if not out.is_dir():
+        raise ValueError("out path is not a directory")
+
+    include = compile_patterns(include)
+    exclude = compile_patterns(exclude)
+
+    index = DestinationIndex(out)
+    folders = set()
+
+    with nullcontext(progress) if progress else Progress() as progress:
+        for member in progress.timed(members(archive), "read"):
+            name = os.path.basename(member.name)
+
+            # Names like "x/.." would point outside the folder they're sorted
+            # into
+            if name in ("", ".", ".."):
+                _skip(member, "invalid name", progress)
+                continue
+
+            if exclude and exclude.match(name):
+                continue
+            if include and not include.match(name):
+                continue
+
+            try:
+                folder = _extract(member, name, out, index, rename, progress)
+            except _CORRUPT as err:
+                logging.error("Skipping %s: corrupt member of archive", member.name)
+                logging.error("%s", err)
+                progress.add_failed()
+                continue
+
+            if folder:
+                folders.add(folder)
+
+    return folders
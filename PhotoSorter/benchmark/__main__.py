@@ -0,0 +1,42 @@
+from argparse import ArgumentParser
+import tempfile
+
+from .. import logs
+from . import corpus, suite
+
+parser = ArgumentParser(
+    prog="python -m PhotoSorter.benchmark",
+    description="Time sorting a reproducible synthetic set of photos",
+)
+parser.add_argument("report", help="JSON file to write the results to")
+parser.add_argument("--files", type=int, default=corpus.DEFAULT_FILES)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--repeats", type=int, default=suite.DEFAULT_REPEATS)
+parser.add_argument("--stages", nargs="+", choices=suite.STAGES, default=suite.STAGES)
+parser.add_argument("--workers", type=int)
+parser.add_argument("--mode", default="thread")
+parser.add_argument("--reader", default="header")
+parser.add_argument(
+    "--dir", help="Folder to generate the photos in. A temporary folder if unset."
+)
+args = parser.parse_args()
+
+# Don't let every skipped file slow down the benchmark
+logs.configure(level="INFO", path=None)
+logs.main_log.getChild("PhotoSorter.disk_sorter").setLevel("ERROR")
+
+options = dict(mode=args.mode, reader=args.reader)
+if args.workers:
+    options["workers"] = args.workers
+
+with tempfile.TemporaryDirectory(prefix="photo-sorter-benchmark-") as temp:
+    report = suite.run_benchmark(
+        args.dir or temp,
+        files=args.files,
+        seed=args.seed,
+        repeats=args.repeats,
+        stages=args.stages,
+        **options,
+    )
+
+suite.write_report(report, args.report)
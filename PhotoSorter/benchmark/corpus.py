@@ -0,0 +1,237 @@
+from PIL import Image
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+import io
+import os
+import random
+import struct
+
+from .. import main_log
+from ..bmff import CREATION_DATE_KEY, QUICKTIME_EPOCH
+
+logging = main_log.getChild(__name__)
+
+DEFAULT_FILES = 1000
+"""Default number of files in a corpus"""
+
+DEFAULT_MIX = {
+    "exif": 0.55,
+    "exif_original": 0.15,
+    "no_exif": 0.1,
+    "video": 0.1,
+    "corrupt": 0.05,
+    "other": 0.05,
+}
+"""Default share of each kind of file in a corpus.
+
+``exif`` photos have an EXIF DateTime tag, ``exif_original`` photos only a
+DateTimeOriginal tag and ``no_exif`` photos no EXIF metadata at all. ``video``
+files are MP4 or QuickTime videos with a creation date, ``corrupt`` files look
+like JPEGs by name but can't be read, and ``other`` files are text files.
+"""
+
+DEFAULT_COLLISIONS = 0.05
+"""Default share of photos given the same name and date as an earlier photo.
+Half of these are identical copies, and half have different content."""
+
+FIRST_DATE = datetime(2000, 1, 1)
+LAST_DATE = datetime(2024, 12, 31)
+
+
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def make_video(taken: datetime, quicktime: bool, media_size: int = 4096) -> bytes:
+    """Make a minimal video with a creation date and some dummy media data.
+
+    QuickTime videos get a QuickTime creation date, and MP4 videos only the
+    creation time of their movie header. The media data comes first, like in
+    videos straight from cameras.
+
+    Args:
+        taken: When the video was recorded
+        quicktime: Whether to make a QuickTime video rather than an MP4 video
+        media_size: The number of bytes of dummy media data
+    """
+    seconds = int((taken - QUICKTIME_EPOCH).total_seconds())
+    movie = _box(
+        b"mvhd", b"\0\0\0\0" + struct.pack(">II", seconds, seconds) + b"\0" * 88
+    )
+
+    if quicktime:
+        key = struct.pack(">I4s", 8 + len(CREATION_DATE_KEY), b"mdta")
+        keys = _box(
+            b"keys", b"\0\0\0\0" + struct.pack(">I", 1) + key + CREATION_DATE_KEY
+        )
+        value = taken.strftime("%Y-%m-%dT%H:%M:%S+0000").encode()
+        data = _box(b"data", struct.pack(">II", 1, 0) + value)
+        items = _box(b"ilst", _box(struct.pack(">I", 1), data))
+        movie += _box(b"meta", _box(b"hdlr", b"\0" * 25) + keys + items)
+
+    brand = b"qt  " if quicktime else b"isom"
+    return (
+        _box(b"ftyp", brand + b"\0\0\0\0" + brand)
+        + _box(b"mdat", b"\0" * media_size)
+        + _box(b"moov", movie)
+    )
+
+
+def make_photo(
+    rng: random.Random,
+    taken: datetime | None,
+    original_only: bool = False,
+    size: Tuple[int, int] = (64, 48),
+) -> bytes:
+    """Make a small JPEG of random noise, optionally with EXIF dates.
+
+    Args:
+        rng: The source of randomness, so that photos are reproducible
+        taken: When the photo was taken. No EXIF metadata is added if None.
+        original_only: Whether to only set the DateTimeOriginal tag, rather
+            than the DateTime tag
+        size: The width and height of the photo
+    """
+    pixels = rng.randbytes(size[0] * size[1] * 3)
+    image = Image.frombytes("RGB", size, pixels)
+
+    options = dict()
+    if taken:
+        exif = Image.Exif()
+        value = taken.strftime("%Y:%m:%d %H:%M:%S")
+        if original_only:
+            exif.get_ifd(0x8769)[0x9003] = value
+        else:
+            exif[0x0132] = value
+        options["exif"] = exif
+
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=75, **options)
+    return buf.getvalue()
+
+
+def _folders(root: str, depth: int, fanout: int) -> List[str]:
+    folders = [root]
+    level = [root]
+    for d in range(depth):
+        level = [
+            os.path.join(parent, f"{d}_{i}") for parent in level for i in range(fanout)
+        ]
+        folders.extend(level)
+
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+
+    return folders
+
+
+def generate_corpus(
+    root: str | os.PathLike,
+    files: int = DEFAULT_FILES,
+    seed: int = 0,
+    depth: int = 2,
+    fanout: int = 4,
+    mix: Dict[str, float] | None = None,
+    collisions: float = DEFAULT_COLLISIONS,
+    photo_size: Tuple[int, int] = (64, 48),
+) -> dict:
+    """Generate a synthetic set of photos to sort.
+
+    The same arguments always generate exactly the same files, so benchmarks
+    can be repeated and compared. The files are spread randomly over a tree of
+    nested folders in ``root/src``, and an empty ``root/out`` is created to
+    sort them into.
+
+    Args:
+        root: The folder to generate the files in
+        files: The number of files to generate
+        seed: Seeds the randomness
+        depth: The depth of the folder tree
+        fanout: The number of subfolders of each folder
+        mix: The share of each kind of file. See ``DEFAULT_MIX``.
+        collisions: The share of photos with the same name and date as an
+            earlier photo, in another folder. See ``DEFAULT_COLLISIONS``.
+        photo_size: The width and height of the photos, to make the photos
+            bigger or smaller
+
+    Returns:
+        A description of the corpus: the arguments, the number of files of
+        each kind and the total number of bytes
+
+    Raises:
+        ValueError: If ``root/src`` already exists
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+
+    source = os.path.join(root, "src")
+    if os.path.exists(source):
+        raise ValueError("Corpus already exists", source)
+
+    folders = _folders(source, depth, fanout)
+    os.makedirs(os.path.join(root, "out"), exist_ok=True)
+
+    kinds = Counter()
+    total_bytes = 0
+    span = int((LAST_DATE - FIRST_DATE).total_seconds())
+
+    # The name, date, folder and content of earlier photos, to collide with
+    photos = list()
+
+    for i, kind in enumerate(
+        rng.choices(list(mix), weights=list(mix.values()), k=files)
+    ):
+        folder = rng.choice(folders)
+        taken = FIRST_DATE + timedelta(seconds=rng.randrange(span))
+
+        if kind in ("exif", "exif_original") and photos and rng.random() < collisions:
+            name, taken, other_folder, data = rng.choice(photos)
+
+            # Put the photo anywhere its namesake isn't
+            folder = rng.choice([f for f in folders if f != other_folder] or folders)
+            if rng.random() < 0.5:
+                kind = "duplicate"
+            else:
+                kind = "collision"
+                data = make_photo(rng, taken, size=photo_size)
+        elif kind in ("exif", "exif_original", "no_exif"):
+            name = f"IMG_{i:06}.jpg"
+            data = make_photo(
+                rng,
+                taken if kind != "no_exif" else None,
+                original_only=kind == "exif_original",
+                size=photo_size,
+            )
+            if kind != "no_exif":
+                photos.append((name, taken, folder, data))
+        elif kind == "video":
+            quicktime = rng.random() < 0.5
+            name = f"VID_{i:06}.{'mov' if quicktime else 'mp4'}"
+            data = make_video(taken, quicktime)
+        elif kind == "corrupt":
+            name = f"IMG_{i:06}.jpg"
+            data = b"\xff\xd8" + rng.randbytes(rng.randrange(16, 1024))
+        else:
+            name = f"notes_{i:06}.txt"
+            data = b"Not a photo\n" * rng.randrange(1, 100)
+
+        with open(os.path.join(folder, name), mode="wb") as f:
+            f.write(data)
+
+        kinds[kind] += 1
+        total_bytes += len(data)
+
+    logging.info("Generated %s files (%s bytes) in %s", files, total_bytes, source)
+
+    return {
+        "files": files,
+        "seed": seed,
+        "depth": depth,
+        "fanout": fanout,
+        "mix": mix,
+        "collisions": collisions,
+        "photo_size": list(photo_size),
+        "kinds": dict(kinds),
+        "bytes": total_bytes,
+    }
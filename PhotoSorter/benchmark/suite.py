@@ -0,0 +1,173 @@
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+
+from .. import __version__
+from .. import disk_sorter
+from .. import main_log
+from .. import probe
+from .. import walker
+from ..progress import Progress
+from . import corpus
+
+logging = main_log.getChild(__name__)
+
+STAGES = ("walk", "probe", "plan", "move")
+"""The stages of sorting that can be timed.
+
+``walk`` finds the files, ``probe`` also reads their dates, ``plan`` also works
+out where each file goes, and ``move`` sorts the files with
+``disk_sorter.move_photos``.
+"""
+
+DEFAULT_REPEATS = 3
+"""Default number of times each stage is timed"""
+
+REPORT_VERSION = 1
+"""Version of the benchmark report format"""
+
+
+def _summarise(runs: List[float], files: int) -> dict:
+    return {
+        "runs": runs,
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.fmean(runs),
+        "files_per_second": files / min(runs) if min(runs) else None,
+    }
+
+
+def run_benchmark(
+    root: str | os.PathLike,
+    files: int = corpus.DEFAULT_FILES,
+    seed: int = 0,
+    repeats: int = DEFAULT_REPEATS,
+    stages: Iterable[str] = STAGES,
+    corpus_options: dict | None = None,
+    **options,
+) -> dict:
+    """Time the stages of sorting a synthetic corpus.
+
+    The corpus is generated once in ``root/corpus``. The ``move`` stage sorts a
+    fresh copy of it in ``root/work`` each time, and the copying isn't timed.
+    Files are read through the OS cache after the first run, so the results
+    measure the sorter rather than the storage.
+
+    Args:
+        root: The folder to work in
+        files: The number of files in the corpus
+        seed: Seeds the generation of the corpus
+        repeats: The number of times to time each stage
+        stages: The stages to time. See ``STAGES``.
+        corpus_options: Passed on to ``corpus.generate_corpus``
+        options: Passed on to ``disk_sorter.plan_moves``, e.g. ``workers``,
+            ``mode`` and ``reader``
+
+    Returns:
+        The report, which can be written with ``write_report``
+    """
+    stages = list(stages)
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError("Unknown stage", stage)
+
+    root = Path(root)
+    pristine = root / "corpus"
+
+    start = time.perf_counter()
+    description = corpus.generate_corpus(
+        pristine, files=files, seed=seed, **(corpus_options or dict())
+    )
+    description["seconds_to_generate"] = time.perf_counter() - start
+
+    source = pristine / "src"
+    probe_options = {
+        key: options[key] for key in ("workers", "mode", "reader") if key in options
+    }
+
+    def walk():
+        return sum(1 for _ in walker.walk(source, stat=True))
+
+    def probe_all():
+        return sum(1 for _ in probe.probe_files(walker.walk(source), **probe_options))
+
+    def plan():
+        out = root / "plan-out"
+        out.mkdir(exist_ok=True)
+        return sum(1 for _ in disk_sorter.plan_moves(source, out, **options))
+
+    timers: Dict[str, Callable] = {"walk": walk, "probe": probe_all, "plan": plan}
+
+    results = dict()
+    progress = None
+
+    for stage in stages:
+        runs = list()
+
+        for _ in range(repeats):
+            if stage == "move":
+                seconds, progress = _time_move(pristine, root / "work", options)
+            else:
+                start = time.perf_counter()
+                timers[stage]()
+                seconds = time.perf_counter() - start
+
+            runs.append(seconds)
+
+        results[stage] = _summarise(runs, files)
+        logging.info(
+            "%s: %.3fs best of %s, %.1f files/s",
+            stage,
+            results[stage]["min"],
+            repeats,
+            results[stage]["files_per_second"] or 0,
+        )
+
+    return {
+        "photo_sorter_benchmark": REPORT_VERSION,
+        "version": __version__,
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": options,
+        "repeats": repeats,
+        "corpus": description,
+        "stages": results,
+        # How the time of the last move run was spent, and what was skipped
+        "progress": progress,
+    }
+
+
+def _time_move(pristine: Path, work: Path, options: dict):
+    shutil.rmtree(work, ignore_errors=True)
+    shutil.copytree(pristine, work)
+
+    # Only summarise the progress in the report
+    progress = Progress(interval=float("inf"))
+
+    start = time.perf_counter()
+    disk_sorter.move_photos(work / "src", work / "out", progress=progress, **options)
+    seconds = time.perf_counter() - start
+
+    shutil.rmtree(work)
+    return seconds, progress.snapshot()
+
+
+def write_report(report: dict, path: str | os.PathLike):
+    """Write a benchmark report as JSON.
+
+    Args:
+        report: The report from ``run_benchmark``
+        path: The file to write it to
+    """
+    with open(path, mode="w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+    logging.info("Wrote benchmark report to %s", path)
@@ -0,0 +1,365 @@
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+import os
+import struct
+
+from . import exif
+from . import timestamps
+
+VIDEO_EXTENSIONS = (".mp4", ".m4v", ".mov", ".qt", ".3gp", ".3g2")
+"""Extensions of the ISO base media file format (MP4/QuickTime) videos whose
+timestamps can be read here"""
+
+HEIF_EXTENSIONS = (".heic", ".heif", ".hif", ".avif")
+"""Extensions of HEIF images, whose EXIF metadata can be read here"""
+
+CR3_EXTENSIONS = (".cr3",)
+"""Extensions of Canon's ISO base media file format based raw images, whose
+EXIF metadata can be read here"""
+
+CANON_UUID = bytes.fromhex("85c0b687820f11e08111f4ce462b6a48")
+"""The type of the box holding the metadata of CR3 files"""
+
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+"""The time from which ISO base media file format timestamps are counted"""
+
+CREATION_DATE_KEY = b"com.apple.quicktime.creationdate"
+"""The QuickTime metadata key holding the local time a video was recorded"""
+
+MAX_METADATA_SIZE = 16 * 1024 * 1024
+"""The largest metadata box that will be read into memory"""
+
+
+class BoxError(ValueError):
+    """The file isn't a valid ISO base media file, or lacks the boxes needed."""
+
+
+def _boxes(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Iterate over the boxes between two offsets of a file, reading only their
+    headers.
+
+    Yields:
+        The type of each box, the offset of its payload and the offset of its
+        end
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+
+        size, kind = struct.unpack(">I4s", header)
+        payload = pos + 8
+
+        if size == 1:
+            # The real size follows as 64 bits
+            (size,) = struct.unpack(">Q", f.read(8))
+            payload += 8
+        elif size == 0:
+            # The box extends to the end of the file
+            size = end - pos
+
+        if size < payload - pos:
+            raise BoxError("Bad box size", kind, pos)
+
+        yield kind, payload, pos + size
+        pos += size
+
+
+def _find(f: BinaryIO, start: int, end: int, kind: bytes) -> Tuple[int, int]:
+    for box, payload, box_end in _boxes(f, start, end):
+        if box == kind:
+            return payload, box_end
+
+    raise BoxError("Box not found", kind)
+
+
+def _read(f: BinaryIO, start: int, end: int) -> bytes:
+    if end - start > MAX_METADATA_SIZE:
+        raise BoxError("Metadata box too large", end - start)
+
+    f.seek(start)
+    return f.read(end - start)
+
+
+def _movie_header_time(f: BinaryIO, start: int, end: int) -> datetime | None:
+    data = _read(f, start, min(end, start + 20))
+    if len(data) < 8:
+        raise BoxError("Truncated mvhd box")
+
+    if data[0] == 1:
+        (seconds,) = struct.unpack_from(">Q", data, 4)
+    else:
+        (seconds,) = struct.unpack_from(">I", data, 4)
+
+    # Many cameras leave the time unset
+    if seconds == 0:
+        return None
+
+    try:
+        return QUICKTIME_EPOCH + timedelta(seconds=seconds)
+    except OverflowError:
+        # Far past the years a datetime can hold, so the header is garbage
+        raise BoxError("Invalid creation time", seconds)
+
+
+def _quicktime_creation_date(f: BinaryIO, start: int, end: int) -> datetime | None:
+    # In MP4 files the meta box has a version and flags before its children,
+    # but not in QuickTime files
+    f.seek(start)
+    if f.read(4) == b"\x00\x00\x00\x00":
+        start += 4
+
+    # QuickTime metadata is a list of keys, and a list of values whose box types
+    # are the (1-based) indices of their keys
+    try:
+        keys_start, keys_end = _find(f, start, end, b"keys")
+        ilst_start, ilst_end = _find(f, start, end, b"ilst")
+    except BoxError:
+        return None
+
+    keys = _read(f, keys_start, keys_end)
+    (count,) = struct.unpack_from(">I", keys, 4)
+
+    index = None
+    pos = 8
+    for i in range(1, count + 1):
+        (size,) = struct.unpack_from(">I", keys, pos)
+        if size < 8:
+            raise BoxError("Bad metadata key size", size)
+
+        if keys[pos + 8 : pos + size] == CREATION_DATE_KEY:
+            index = struct.pack(">I", i)
+            break
+        pos += size
+
+    if index is None:
+        return None
+
+    for kind, payload, box_end in _boxes(f, ilst_start, ilst_end):
+        if kind != index:
+            continue
+
+        data_start, data_end = _find(f, payload, box_end, b"data")
+        # Skip the type indicator and locale
+        value = _read(f, data_start + 8, data_end).decode("utf-8", "replace")
+
+        try:
+            # e.g. 2019-07-04T15:30:00-0400. The local time is what matters.
+            return timestamps.parse_iso(value).replace(tzinfo=None)
+        except ValueError:
+            return None
+
+    return None
+
+
+def read_video_timestamp(path: str | os.PathLike | BinaryIO) -> datetime | None:
+    """Find when an MP4 or QuickTime video was recorded.
+
+    Only box headers are read until the ``moov`` box is found, seeking past the
+    media data, so this reads a few kilobytes even from huge videos.
+
+    The QuickTime creation date, which is in local time, is preferred. Otherwise
+    the creation time of the movie header is used, which is in UTC.
+
+    Args:
+        path: The path to the video, or the open video
+
+    Returns:
+        When the video was recorded, or None if the video doesn't say
+
+    Raises:
+        BoxError: If the file isn't a valid video
+        OSError: If the file can't be read
+    """
+    with exif.open_binary(path) as f:
+        end = os.fstat(f.fileno()).st_size
+
+        try:
+            moov_start, moov_end = _find(f, 0, end, b"moov")
+
+            try:
+                meta_start, meta_end = _find(f, moov_start, moov_end, b"meta")
+                if created := _quicktime_creation_date(f, meta_start, meta_end):
+                    return created
+            except (BoxError, struct.error):
+                pass
+
+            mvhd_start, mvhd_end = _find(f, moov_start, moov_end, b"mvhd")
+            return _movie_header_time(f, mvhd_start, mvhd_end)
+        except struct.error:
+            raise BoxError("Truncated box")
+
+
+def _uint(data: bytes, pos: int, size: int) -> Tuple[int, int]:
+    # Counts read from the file can't be trusted, so running off the end of
+    # the box must stop whatever loop they drive
+    if pos + size > len(data):
+        raise BoxError("Truncated box")
+    return int.from_bytes(data[pos : pos + size], "big"), pos + size
+
+
+def _exif_item(f: BinaryIO, start: int, end: int) -> int | None:
+    # The item info box lists the items in the file and their types
+    iinf_start, iinf_end = _find(f, start, end, b"iinf")
+    iinf = _read(f, iinf_start, iinf_end)
+
+    # Skip the version, flags and entry count
+    pos = 6 if iinf[0] == 0 else 8
+
+    while pos + 8 <= len(iinf):
+        size, kind = struct.unpack_from(">I4s", iinf, pos)
+        if size < 8:
+            raise BoxError("Bad infe box size", size)
+
+        version = iinf[pos + 8]
+        if kind == b"infe" and version >= 2:
+            item_id, type_pos = _uint(iinf, pos + 12, 2 if version == 2 else 4)
+            if iinf[type_pos + 2 : type_pos + 6] == b"Exif":
+                return item_id
+
+        pos += size
+
+    return None
+
+
+def _item_extents(
+    f: BinaryIO, start: int, end: int, item: int
+) -> List[Tuple[int, int]]:
+    # The item location box says where in the file each item's data is
+    iloc_start, iloc_end = _find(f, start, end, b"iloc")
+    iloc = _read(f, iloc_start, iloc_end)
+
+    version = iloc[0]
+    offset_size = iloc[4] >> 4
+    length_size = iloc[4] & 0x0F
+    base_offset_size = iloc[5] >> 4
+    index_size = iloc[5] & 0x0F if version in (1, 2) else 0
+
+    count, pos = _uint(iloc, 6, 2 if version < 2 else 4)
+
+    for _ in range(count):
+        item_id, pos = _uint(iloc, pos, 2 if version < 2 else 4)
+
+        method = 0
+        if version in (1, 2):
+            method, pos = _uint(iloc, pos, 2)
+            method &= 0x0F
+
+        # Skip the data reference index
+        pos += 2
+        base, pos = _uint(iloc, pos, base_offset_size)
+        extent_count, pos = _uint(iloc, pos, 2)
+
+        extents = list()
+        for _ in range(extent_count):
+            pos += index_size
+            offset, pos = _uint(iloc, pos, offset_size)
+            length, pos = _uint(iloc, pos, length_size)
+            extents.append((base + offset, length))
+
+        if item_id != item:
+            continue
+
+        if method == 1:
+            # Offsets are within the item data box instead of the file
+            idat_start, _ = _find(f, start, end, b"idat")
+            extents = [(idat_start + offset, length) for offset, length in extents]
+        elif method != 0:
+            raise BoxError("Unsupported item construction method", method)
+
+        return extents
+
+    raise BoxError("Item location not found", item)
+
+
+def read_heif_dates(path: str | os.PathLike | BinaryIO) -> Dict[int, str]:
+    """Read the date tags of a HEIF (e.g. HEIC) image without decoding it.
+
+    The EXIF metadata is stored as an item of the file, which is located
+    through the item info and item location boxes, and then only that item is
+    read.
+
+    Args:
+        path: The path to the image, or the open image
+
+    Returns:
+        The values of any of the ``exif.DATE_TAGS`` found, by tag number
+
+    Raises:
+        BoxError: If the file isn't a valid HEIF image
+        exif.ExifError: If the EXIF metadata is malformed
+        OSError: If the file can't be read
+    """
+    with exif.open_binary(path) as f:
+        end = os.fstat(f.fileno()).st_size
+
+        try:
+            meta_start, meta_end = _find(f, 0, end, b"meta")
+
+            # Skip the version and flags
+            meta_start += 4
+
+            item = _exif_item(f, meta_start, meta_end)
+            if item is None:
+                return dict()
+
+            data = b"".join(
+                _read(f, offset, offset + length)
+                for offset, length in _item_extents(f, meta_start, meta_end, item)
+            )
+        except (struct.error, IndexError):
+            raise BoxError("Truncated box")
+
+    # The EXIF data starts with the offset of the TIFF header
+    if len(data) < 4:
+        raise BoxError("Truncated Exif item")
+    (offset,) = struct.unpack_from(">I", data, 0)
+
+    return exif.parse_tiff(data, 4 + offset)
+
+
+def read_cr3_dates(path: str | os.PathLike | BinaryIO) -> Dict[int, str]:
+    """Read the date tags of a Canon CR3 raw image without decoding it.
+
+    CR3 files store their EXIF metadata as small TIFF structures in boxes of a
+    Canon-specific box in the ``moov`` box.
+
+    Args:
+        path: The path to the image, or the open image
+
+    Returns:
+        The values of any of the ``exif.DATE_TAGS`` found, by tag number
+
+    Raises:
+        BoxError: If the file isn't a valid CR3 image
+        exif.ExifError: If the EXIF metadata is malformed
+        OSError: If the file can't be read
+    """
+    with exif.open_binary(path) as f:
+        end = os.fstat(f.fileno()).st_size
+
+        try:
+            moov_start, moov_end = _find(f, 0, end, b"moov")
+
+            for kind, payload, box_end in _boxes(f, moov_start, moov_end):
+                if kind != b"uuid":
+                    continue
+
+                f.seek(payload)
+                if f.read(16) != CANON_UUID:
+                    continue
+
+                dates = dict()
+                for kind, start, stop in _boxes(f, payload + 16, box_end):
+                    # CMT1 holds IFD0 and CMT2 the Exif IFD
+                    if kind in (b"CMT1", b"CMT2"):
+                        tags = exif.parse_tiff(_read(f, start, stop))
+                        dates = {**tags, **dates}
+
+                return dates
+        except struct.error:
+            raise BoxError("Truncated box")
+
+    raise BoxError("Canon metadata box not found")
@@ -0,0 +1,170 @@
+from datetime import datetime
+from pathlib import Path
+import sqlite3
+import time
+import os
+
+from .probe import ProbeResult
+from . import main_log
+
+logging = main_log.getChild(__name__)
+
+DEFAULT_MAX_ENTRIES = 2_000_000
+"""Default maximum number of files remembered by the cache. Past this, the
+least recently used entries are evicted."""
+
+COMMIT_PERIOD = 1000
+"""How many changes to make to the cache before committing them to disk"""
+
+
+class ProbeCache:
+    """An on-disk cache of probe results, so that files that haven't changed
+    since the last run don't have to be opened and parsed again.
+
+    Results are stored by the absolute path of the file, and are only used if
+    the size, modification time and inode of the file are unchanged. Failures
+    are remembered too, so files that couldn't be dated aren't reparsed on
+    every run either.
+
+    The cache must only be used from the thread that created it.
+    """
+
+    def __init__(self, path: str | os.PathLike, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """Open a cache, creating it if it doesn't exist.
+
+        Args:
+            path: The path to the SQLite database holding the cache
+            max_entries: The maximum number of files to remember
+        """
+        self.path = Path(path)
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS probes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                timestamp TEXT,
+                reason TEXT,
+                last_used REAL NOT NULL,
+                source TEXT
+            )""")
+
+        # Caches made before the source of timestamps was recorded
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(probes)")]
+        if "source" not in columns:
+            self._db.execute("ALTER TABLE probes ADD COLUMN source TEXT")
+
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used)"
+        )
+        self._db.commit()
+
+        self._touched = list()
+        self._changes = 0
+
+        logging.debug("Opened probe cache %s", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, path: str | os.PathLike, stat: os.stat_result) -> ProbeResult | None:
+        """Look up the result of probing a file.
+
+        Args:
+            path: The path to the file
+            stat: The current status of the file
+
+        Returns:
+            The cached result, or None if the file isn't in the cache or has
+            changed since it was cached
+        """
+        key = os.path.abspath(path)
+
+        row = self._db.execute(
+            "SELECT size, mtime_ns, inode, timestamp, reason, source FROM probes "
+            "WHERE path = ?",
+            (key,),
+        ).fetchone()
+
+        if not row or row[:3] != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        # Marking entries as used is deferred, since it is only needed when
+        # deciding which entries to evict
+        self._touched.append((time.time(), key))
+        if len(self._touched) >= COMMIT_PERIOD:
+            self.flush()
+
+        timestamp = datetime.fromisoformat(row[3]) if row[3] else None
+        return ProbeResult(os.fspath(path), timestamp, row[4], row[5])
+
+    def put(self, result: ProbeResult, stat: os.stat_result):
+        """Remember the result of probing a file.
+
+        Args:
+            result: The result of the probe
+            stat: The status of the file when it was probed
+        """
+        timestamp = result.timestamp.isoformat() if result.timestamp else None
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                os.path.abspath(result.path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+                timestamp,
+                result.reason,
+                time.time(),
+                result.source,
+            ),
+        )
+        self._changed()
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= COMMIT_PERIOD:
+            self.flush()
+
+    def flush(self):
+        """Write all changes to disk and evict old entries if the cache is too
+        large."""
+        if self._touched:
+            self._db.executemany(
+                "UPDATE probes SET last_used = ? WHERE path = ?", self._touched
+            )
+            self._touched.clear()
+
+        (count,) = self._db.execute("SELECT COUNT(*) FROM probes").fetchone()
+        if count > self.max_entries:
+            logging.debug("Evicting %s cache entries", count - self.max_entries)
+            self._db.execute(
+                """DELETE FROM probes WHERE path IN (
+                    SELECT path FROM probes ORDER BY last_used LIMIT ?
+                )""",
+                (count - self.max_entries,),
+            )
+
+        self._db.commit()
+        self._changes = 0
+
+    def close(self):
+        """Write all changes to disk and close the cache."""
+        self.flush()
+        self._db.close()
+
+        logging.info("Probe cache: %s hits, %s misses", self.hits, self.misses)
@@ -0,0 +1,187 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+import hashlib
+import os
+
+from . import main_log
+
+logging = main_log.getChild(__name__)
+
+PARTIAL_SIZE = 64 * 1024
+"""Number of bytes hashed from each end of a file for a partial hash"""
+
+BUFFER_SIZE = 1024 * 1024
+"""Size of the reads made when hashing a whole file"""
+
+DEFAULT_WORKERS = 4
+"""Default number of files hashed at once"""
+
+DUPLICATE_ACTIONS = ("skip", "delete", "link")
+"""What can be done with a file that is identical to one already sorted.
+
+``skip`` leaves the file where it is, ``delete`` deletes it, and ``link``
+replaces it with a hard link to the sorted copy, so it takes no extra space.
+"""
+
+
+def partial_hash(path: str | os.PathLike, size: int) -> bytes:
+    """Hash the start and end of a file.
+
+    This is cheap even for huge files and tells apart almost all files that
+    differ. For files no bigger than twice ``PARTIAL_SIZE``, the whole file is
+    hashed, so the hash is as good as a full hash.
+
+    Args:
+        path: The file to hash
+        size: The size of the file
+    """
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, mode="rb") as f:
+        h.update(f.read(PARTIAL_SIZE))
+
+        if size > PARTIAL_SIZE:
+            f.seek(max(PARTIAL_SIZE, size - PARTIAL_SIZE))
+            h.update(f.read(PARTIAL_SIZE))
+
+    return h.digest()
+
+
+def full_hash(path: str | os.PathLike, size: int) -> bytes:
+    """Hash a whole file.
+
+    Args:
+        path: The file to hash
+        size: The size of the file
+    """
+    h = hashlib.blake2b()
+    buf = bytearray(BUFFER_SIZE)
+    view = memoryview(buf)
+
+    with open(path, mode="rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            h.update(view[:n])
+
+    return h.digest()
+
+
+class Deduplicator:
+    """Decides whether files have the same content, doing as little work as
+    possible.
+
+    Files are compared by size, then by a partial hash of their start and end,
+    and only if those match by a hash of their whole content. The hashes of
+    both files are computed in parallel, and are remembered for as long as the
+    files are unchanged, so each file is read at most once even if it is
+    compared many times.
+
+    The deduplicator must only be used from the thread that created it.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS):
+        """Prepare to compare files.
+
+        Args:
+            workers: The number of files to hash at once
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="hash"
+        )
+        self._hashes: Dict[tuple, bytes] = dict()
+
+        self.comparisons = 0
+        self.full_comparisons = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _hash_all(self, fn: Callable, files: list) -> list:
+        keys = [
+            (fn.__name__, os.fspath(path), st.st_size, st.st_mtime_ns)
+            for path, st in files
+        ]
+
+        futures = {
+            key: self._executor.submit(fn, path, st.st_size)
+            for key, (path, st) in zip(keys, files)
+            if key not in self._hashes
+        }
+        for key, future in futures.items():
+            self._hashes[key] = future.result()
+
+        return [self._hashes[key] for key in keys]
+
+    def same_content(self, a: str | os.PathLike, b: str | os.PathLike) -> bool:
+        """Check whether two files have exactly the same content.
+
+        Args:
+            a: The path to the first file
+            b: The path to the second file
+
+        Raises:
+            OSError: If either file can't be read
+        """
+        self.comparisons += 1
+
+        files = [(a, os.stat(a)), (b, os.stat(b))]
+        (_, sa), (_, sb) = files
+
+        if sa.st_size != sb.st_size:
+            return False
+        if (sa.st_dev, sa.st_ino) == (sb.st_dev, sb.st_ino):
+            return True
+
+        first, second = self._hash_all(partial_hash, files)
+        if first != second:
+            return False
+        if sa.st_size <= 2 * PARTIAL_SIZE:
+            return True
+
+        self.full_comparisons += 1
+        first, second = self._hash_all(full_hash, files)
+        return first == second
+
+    def prune(self):
+        """Forget the hashes of files that have since changed or been removed,
+        so a long-lived deduplicator doesn't keep growing."""
+        for key in list(self._hashes):
+            _, path, size, mtime_ns = key
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._hashes[key]
+                continue
+
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                del self._hashes[key]
+
+    def close(self):
+        """Stop the hashing threads."""
+        self._executor.shutdown(wait=True)
+
+        logging.debug(
+            "Compared %s files, %s fully", self.comparisons, self.full_comparisons
+        )
+
+
+def link_duplicate(duplicate: str | os.PathLike, original: str | os.PathLike):
+    """Replace a file with a hard link to an identical file.
+
+    The link is created next to the duplicate first and then renamed over it,
+    so the duplicate is never missing.
+
+    Args:
+        duplicate: The file to replace
+        original: The file to link to
+    """
+    duplicate = os.fspath(duplicate)
+    temp = f"{duplicate}.link"
+
+    os.link(original, temp)
+    try:
+        os.replace(temp, duplicate)
+    except BaseException:
+        os.unlink(temp)
+        raise
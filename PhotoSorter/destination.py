@@ -0,0 +1,102 @@
+from pathlib import Path
+from typing import Dict, Set
+import os
+
+from . import main_log
+
+logging = main_log.getChild(__name__)
+
+
+class DestinationIndex:
+    """An in-memory index of the year and month folders of the sorted file
+    tree and the files in them.
+
+    The tree is scanned once when the index is created, after which checking
+    whether a folder or file exists doesn't touch the file system, which saves
+    a round trip per file on network storage. The index must be told about
+    every change made to the tree, and it assumes nothing else changes the tree
+    while it is in use.
+    """
+
+    def __init__(self, out: str | os.PathLike):
+        """Scan the sorted file tree.
+
+        Args:
+            out: The top-level folder of the sorted file tree
+        """
+        self.out = Path(out)
+
+        # The names of the files in each folder, by (year, month) folder name
+        self._folders: Dict[tuple, Set[str]] = dict()
+
+        for year in self._subfolders(self.out):
+            for month in self._subfolders(self.out / year):
+                names = set()
+                with os.scandir(self.out / year / month) as entries:
+                    for entry in entries:
+                        names.add(os.path.normcase(entry.name))
+                self._folders[(year, month)] = names
+
+        logging.debug("Indexed %s folders in %s", len(self._folders), self.out)
+
+    @staticmethod
+    def _subfolders(path: Path):
+        with os.scandir(path) as entries:
+            # Only numbered folders can be part of the sorted tree
+            return [
+                entry.name
+                for entry in entries
+                if entry.name.isdigit() and entry.is_dir(follow_symlinks=False)
+            ]
+
+    def folder(self, year: str, month: str) -> Path:
+        """Get the folder for a year and month, creating it if necessary.
+
+        Args:
+            year: The name of the year folder
+            month: The name of the month folder
+
+        Returns:
+            The path to the folder
+        """
+        path = self.out / year / month
+
+        if (year, month) not in self._folders:
+            logging.debug("Creating output directory %s/%s", year, month)
+            os.makedirs(path, exist_ok=True)
+            self._folders[(year, month)] = set()
+
+        return path
+
+    def contains(self, year: str, month: str, name: str) -> bool:
+        """Check whether a file exists in the folder for a year and month.
+
+        Args:
+            year: The name of the year folder
+            month: The name of the month folder
+            name: The name of the file
+        """
+        names = self._folders.get((year, month))
+        return names is not None and os.path.normcase(name) in names
+
+    def add(self, year: str, month: str, name: str):
+        """Record that a file was added to the folder for a year and month.
+
+        Args:
+            year: The name of the year folder
+            month: The name of the month folder
+            name: The name of the file
+        """
+        self._folders.setdefault((year, month), set()).add(os.path.normcase(name))
+
+    def remove(self, year: str, month: str, name: str):
+        """Record that a file was removed from the folder for a year and month.
+
+        Args:
+            year: The name of the year folder
+            month: The name of the month folder
+            name: The name of the file
+        """
+        names = self._folders.get((year, month))
+        if names is not None:
+            names.discard(os.path.normcase(name))
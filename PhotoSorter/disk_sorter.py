@@ -1,23 +1,111 @@
-from PIL import Image, ExifTags
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Container, Dict, Iterable, Iterator, Sequence, Tuple
+import itertools
+import time
 import logging
-import shutil
 import os
 
 from . import main_log
+from . import near_dup
+from . import probe
+from . import sidecars
+from . import transfer
+from . import walker
+from .cache import ProbeCache
+from .destination import DestinationIndex
+from .journal import MoveJournal
+from . import plan
+from .dedup import DUPLICATE_ACTIONS, Deduplicator, link_duplicate
+from .plan import PlannedMove
+from .progress import Progress
 
 logging = main_log.getChild(__name__)
 
 
-def move_photos(source: Path, out: Path, max_files=float("inf")):
+def move_photos(
+    source: Path,
+    out: Path,
+    max_files=float("inf"),
+    copy_workers: int = transfer.DEFAULT_COPY_WORKERS,
+    journal: str | os.PathLike | None = None,
+    near_duplicates: bool = False,
+    progress: Progress | None = None,
+    output: str = "move",
+    **options,
+):
     """Sort photos on a local disk file path into subfolder based upon the
     photos' metadata.
 
+    This plans and executes the moves at the same time, so files are moved
+    while later files are still being examined.
+
     Args:
         source: The source directory from which to sort the contained photos
         out: The out directory to put the sorted file tree
         max_files: The maximum number of files to sort
+        copy_workers: See ``execute_plan``
+        journal: The path to a journal of the moves made. If the run is
+            interrupted, running again with the same journal resumes where it
+            left off without examining the files already moved. The journal
+            is deleted once the run finishes. No journal is kept if None.
+        near_duplicates: Whether to look for near-duplicates, like burst shots
+            and recompressed copies, in the folders photos were moved into once
+            sorting is done. These are only logged, not moved.
+        progress: Tracks how sorting is going. If None, a summary is logged
+            once sorting is done.
+        output: How files are put into the sorted tree, one of
+            ``transfer.OUTPUT_MODES``. Any mode but ``"move"`` leaves the
+            source untouched and builds a dated view of it in ``out``.
+        options: Passed on to ``plan_moves``, which describes them
+
+    Raises:
+        ValueError: If ``output`` is unknown, or if duplicates would be deleted
+            or linked while the source is being kept
     """
+    if output not in transfer.OUTPUT_MODES:
+        raise ValueError("Unknown output mode", output)
+
+    # A duplicate's original in the sorted tree may be no more than a link to
+    # another file in the source, so the source must be left alone
+    duplicates = options.get("duplicates", plan.SKIP)
+    if output != "move" and duplicates != plan.SKIP:
+        raise ValueError("Duplicates can only be removed when moving", duplicates)
+
+    with (
+        MoveJournal(journal, output) if journal else nullcontext() as move_journal,
+        Deduplicator() as deduplicator,
+        nullcontext(progress) if progress else Progress() as progress,
+    ):
+        moves = plan_moves(
+            source,
+            out,
+            max_files=max_files,
+            skip=move_journal.done if move_journal else (),
+            deduplicator=deduplicator,
+            progress=progress,
+            **options,
+        )
+        folders = execute_plan(
+            moves,
+            out,
+            copy_workers=copy_workers,
+            journal=move_journal,
+            deduplicator=deduplicator,
+            progress=progress,
+            output=output,
+        )
+
+        # Everything that was started has finished, so there is nothing left
+        # to resume
+        if move_journal:
+            move_journal.discard()
+
+    if near_duplicates:
+        near_dup.find_near_duplicates(out, folders)
+
+
+def _check_directories(source: Path, out: Path):
     if not source.exists():
         raise ValueError("source path does not exist")
     if not out.exists():
@@ -28,69 +116,515 @@ def move_photos(source: Path, out: Path, max_files=float("inf")):
     if not out.is_dir():
         raise ValueError("out path is not a directory")
 
-    for i, file in enumerate(source.iterdir()):
-        if i % 1000 == 0:
-            print(f"Moved {i} files")
 
-        if i > max_files:
-            logging.info(f"Maximum files ({max_files}) reached. Stopping")
-            break
+def plan_moves(
+    source: Path,
+    out: Path,
+    max_files=float("inf"),
+    workers: int | None = None,
+    mode: str = "thread",
+    reader: str = "header",
+    cache: str | os.PathLike | None = None,
+    recursive: bool = True,
+    include: Iterable[str] | None = None,
+    exclude: Iterable[str] | None = None,
+    skip: Container[str] = (),
+    duplicates: str = plan.SKIP,
+    rename: bool = False,
+    deduplicator: Deduplicator | None = None,
+    progress: Progress | None = None,
+    files: Iterable[str | os.PathLike] | None = None,
+    group_sidecars: bool = True,
+    sources: Sequence[str] = probe.DEFAULT_SOURCES,
+    filename_patterns: Iterable[str] | None = None,
+    index: DestinationIndex | None = None,
+) -> Iterator[PlannedMove]:
+    """Work out where each photo in a directory should be moved to, without
+    moving anything.
+
+    The plan is produced lazily, one move at a time, in the order the files are
+    found. Files that shouldn't be moved are included in the plan, with the
+    reason they are skipped.
 
-        if not file.is_file():
-            logging.info(f"Skipping {file.name}: not a file")
-            continue
-
-        if file.name.endswith(".mp4"):
-            logging.info(f"Skipping {file.name}: mp4")
-            continue
-
-        try:
-            image = Image.open(file)
-        except OSError as err:
-            logging.warning(f"Skipping {file.name}: PIL failed to open image")
-            # logging.warning(f"{err}")
-            continue
-
-        try:
-            exif_data = image.getexif()
-        except Exception as err:
-            logging.warning(f"Skipping {file.name}: Unable to retrieve EXIF data")
-            continue
-
-        # Exif.Image.DateTime, hex: 0x0132, dec: 306
-        timestamp = exif_data.get(ExifTags.Base.DateTime)
-
-        # Try something else if the timestamp doesn't exist
-        if not timestamp:
-            # Exif.Photo.DateTimeOriginal, hex: 0x9003, dec: 36867
-            timestamp = exif_data.get_ifd(ExifTags.IFD.Exif).get(
-                ExifTags.Base.DateTimeOriginal
+    Args:
+        source: The source directory from which to sort the contained photos
+        out: The out directory to put the sorted file tree
+        max_files: The maximum number of files to sort
+        workers: The number of files whose metadata is read concurrently. Use
+            1 to read files one at a time. Defaults depend on ``mode``.
+        mode: How metadata is read concurrently, either ``"thread"`` for
+            storage-bound sorting or ``"process"`` for CPU-bound sorting. See
+            ``probe.EXECUTION_MODES``.
+        reader: How the photos' metadata is read. See ``probe.READERS``.
+        cache: The path to a database caching the photos' metadata between
+            runs, so unchanged files that weren't moved aren't read again.
+            Created if it doesn't exist. No cache is used if None.
+        recursive: Whether to sort photos in subdirectories of ``source`` too.
+            ``out`` is never searched for photos, even if it is inside
+            ``source``.
+        include: Shell-style patterns of the file names to sort, e.g.
+            ``["*.jpg", "*.heic"]``. All files are considered if None.
+        exclude: Shell-style patterns of file and directory names to ignore
+        skip: Absolute paths of files to leave out of the plan entirely, e.g.
+            because they have already been moved
+        duplicates: What to do with files identical to one already in (or
+            planned for) the sorted tree under the same name. See
+            ``dedup.DUPLICATE_ACTIONS``.
+        rename: Whether to give files a new name, e.g. ``IMG_0001 (1).JPG``,
+            when a different file with the same name is already in the sorted
+            tree. Otherwise they are skipped.
+        deduplicator: Used to compare files, so that the hashes of files can
+            be shared with ``execute_plan``. Created if None.
+        progress: Timings of the ``"scan"`` and ``"probe"`` stages are added to
+            this, if given
+        files: The files to sort, instead of all those in ``source``. Only
+            their names are checked against ``include`` and ``exclude``.
+        group_sidecars: Whether to sort sidecars, like ``.xmp`` and ``.aae``
+            files, and the videos of Live Photos together with the photo they
+            belong to, rather than on their own. See ``sidecars.group_files``.
+            Each group is dated from its photo, and is planned right after it.
+        sources: Where to look for when each file was taken, in order. See
+            ``probe.SOURCES``. The source and how far it can be trusted are
+            given as the reason of each move.
+        filename_patterns: Regular expressions matching timestamps in file
+            names. Defaults to ``timestamps.FILENAME_PATTERNS``.
+        index: An index of ``out`` to plan against, so that the sorted tree
+            isn't scanned again for each plan, e.g. while watching. Files are
+            added to it as they are planned, so it must not be the index given
+            to ``execute_plan``. Created if None.
+    """
+    if duplicates not in DUPLICATE_ACTIONS:
+        raise ValueError("Unknown action for duplicates", duplicates)
+
+    _check_directories(source, out)
+
+    # Tracks the files that will be in the sorted tree once the plan is
+    # executed, not just those there now
+    if index is None:
+        index = DestinationIndex(out)
+
+    # The sizes of the files currently being probed
+    sizes = dict()
+
+    # The sidecars and Live Photo videos of the files being probed
+    companions = dict()
+
+    def timed(items, stage):
+        return progress.timed(items, stage) if progress else items
+
+    def candidates():
+        # Plans are made of absolute paths, so they can be carried out from
+        # any working directory
+        if files is None:
+            found = walker.walk(
+                os.path.abspath(source),
+                recursive=recursive,
+                include=include,
+                exclude=exclude,
+                prune=[out],
+                stat=True,
+            )
+        else:
+            # Sorted so that files in the same directory can be grouped
+            found = walker.records(
+                sorted(os.path.abspath(file) for file in files),
+                include=include,
+                exclude=exclude,
+                stat=True,
             )
 
-        if not timestamp:
-            logging.warning(f"Skipping {file.name}: Unable to retrieve timestamp")
+        found = timed(found, "scan")
+        if skip:
+            found = (file for file in found if os.path.abspath(file.path) not in skip)
+
+        if group_sidecars:
+            groups = sidecars.group_files(found)
+        else:
+            groups = (sidecars.FileGroup(file, []) for file in found)
+
+        for i, (file, belonging) in enumerate(groups):
+            if i > max_files:
+                logging.info("Maximum files (%s) reached. Stopping", max_files)
+                break
+
+            sizes[file.path] = file.stat.st_size
+            if belonging:
+                companions[file.path] = belonging
+            yield file
+
+    # Only compare files when something other than skipping can come of it
+    compare = duplicates != plan.SKIP or rename
+
+    # The sources of the files planned to be moved, by their destination
+    claimed = dict()
+
+    def resolve_collision(path, size, year, month, filename) -> PlannedMove:
+        stem, ext = os.path.splitext(filename)
+
+        for n in itertools.count(1):
+            key = (year, month, os.path.normcase(filename))
+
+            if not index.contains(year, month, filename):
+                # Different content, and this name is free
+                index.add(year, month, filename)
+                claimed[key] = path
+                reason = "renamed to avoid name collision"
+                return PlannedMove(path, f"{year}/{month}/{filename}", size, reason)
+
+            # Files that are yet to be moved might have been moved meanwhile
+            existing = [out / year / month / filename]
+            if key in claimed:
+                existing.insert(0, claimed[key])
+
+            for other in existing:
+                try:
+                    duplicate = deduplicator.same_content(path, other)
+                    break
+                except FileNotFoundError:
+                    continue
+                except OSError as err:
+                    reason = f"Unable to compare with existing file: {err}"
+                    return PlannedMove(path, None, size, reason, plan.SKIP)
+            else:
+                duplicate = False
+
+            if duplicate:
+                destination = f"{year}/{month}/{filename}"
+                if duplicates == plan.SKIP:
+                    reason = f"duplicate: {destination}"
+                    return PlannedMove(path, None, size, reason, plan.SKIP)
+                return PlannedMove(path, destination, size, "duplicate", duplicates)
+
+            if not rename:
+                reason = "already exists at out directory"
+                return PlannedMove(path, None, size, reason, plan.SKIP)
+
+            filename = f"{stem} ({n}){ext}"
+
+    def place(result: probe.ProbeResult, size: int) -> PlannedMove:
+        if result.reason:
+            return PlannedMove(result.path, None, size, result.reason, plan.SKIP)
+
+        year = f"{result.timestamp.year:0>4}"
+        month = f"{result.timestamp.month:0>2}"
+        filename = os.path.basename(result.path)
+
+        if index.contains(year, month, filename):
+            if not compare:
+                reason = "already exists at out directory"
+                return PlannedMove(result.path, None, size, reason, plan.SKIP)
+
+            return resolve_collision(result.path, size, year, month, filename)
+
+        index.add(year, month, filename)
+        if compare:
+            claimed[(year, month, os.path.normcase(filename))] = result.path
+        destination = f"{year}/{month}/{filename}"
+        if result.source:
+            confidence = probe.CONFIDENCE[result.source]
+            reason = f"date from {result.source} ({confidence} confidence)"
+        else:
+            reason = "metadata"
+        return PlannedMove(result.path, destination, size, reason)
+
+    def place_companion(companion: walker.FileRecord, move: PlannedMove):
+        # Companions go wherever the file they belong to goes, under a
+        # matching name
+        size = companion.stat.st_size
+        name = os.path.basename(move.source)
+
+        if move.action != plan.MOVE:
+            # Duplicates' sidecars may hold edits the sorted copy lacks, so
+            # they are left for the user to look at
+            kind = "skipped file" if move.action == plan.SKIP else "duplicate"
+            reason = f"sidecar of {kind}: {name}"
+            return PlannedMove(companion.path, None, size, reason, plan.SKIP)
+
+        year, month, renamed = move.destination.split("/")
+        filename = sidecars.companion_name(companion.name, name, renamed)
+
+        if index.contains(year, month, filename):
+            reason = "already exists at out directory"
+            return PlannedMove(companion.path, None, size, reason, plan.SKIP)
+
+        index.add(year, month, filename)
+        if compare:
+            claimed[(year, month, os.path.normcase(filename))] = companion.path
+        destination = f"{year}/{month}/{filename}"
+        return PlannedMove(companion.path, destination, size, f"sidecar of {name}")
+
+    with (
+        ProbeCache(cache) if cache else nullcontext() as probe_cache,
+        nullcontext(deduplicator) if deduplicator else Deduplicator() as deduplicator,
+    ):
+        results = probe.probe_files(
+            candidates(),
+            workers=workers,
+            mode=mode,
+            reader=reader,
+            cache=probe_cache,
+            sources=sources,
+            filename_patterns=filename_patterns,
+        )
+        results = timed(results, "probe")
+
+        for result in results:
+            move = place(result, sizes.pop(result.path))
+            yield move
+
+            for companion in companions.pop(result.path, ()):
+                yield place_companion(companion, move)
+
+
+def _split_destination(destination: str) -> Tuple[str, str, str]:
+    # Plans may have been edited by hand, so a destination must not be able to
+    # point outside its folder of the sorted tree, e.g. with "../.."
+    year, month, name = destination.split("/")
 
-        try:
-            date, time = timestamp.split(" ")
-            year, month, day = date.split(":")
-        except Exception as err:
-            logging.warning(f"Skipping {file.name}: Unable to parse timestamp")
+    separators = (os.sep, os.altsep, "\\")
+    if (
+        not (year.isdigit() and month.isdigit())
+        or name in ("", ".", "..")
+        or any(sep and sep in name for sep in separators)
+    ):
+        raise ValueError("Invalid destination", destination)
 
-        image.close()
-        filename = file.name
+    return year, month, name
 
-        logging.debug(f"Moving {filename}, date: {year}-{month}")
 
-        out_dir = out / f"{year}" / f"{month}"
+def execute_plan(
+    moves: Iterable[PlannedMove],
+    out: Path,
+    copy_workers: int = transfer.DEFAULT_COPY_WORKERS,
+    journal: MoveJournal | None = None,
+    deduplicator: Deduplicator | None = None,
+    progress: Progress | None = None,
+    output: str = "move",
+    index: DestinationIndex | None = None,
+):
+    """Carry out a move plan.
+
+    The plan is consumed one move at a time, so it can be arbitrarily large,
+    and can come straight from ``plan_moves`` or from a file with
+    ``plan.read_plan``. Since the plan may be out of date, files are never
+    moved over files already in the sorted tree, and since it may have been
+    edited, moves to anywhere but a year and month folder of the sorted tree
+    are skipped.
+
+    Args:
+        moves: The moves to carry out
+        out: The out directory to put the sorted file tree
+        copy_workers: The number of files copied at once when files are on a
+            different device to ``out``. On the same device, files are simply
+            renamed.
+        journal: A journal to record the moves in. Moves left unfinished by an
+            earlier run are finished first, and moves the journal records as
+            done are skipped.
+        deduplicator: Used to check that duplicates really are identical to
+            the sorted file before deleting or linking them. Created if None.
+        progress: Tracks what happens to each file and the time spent getting
+            the next move (the ``"plan"`` stage) and moving files. If None,
+            progress is tracked and summarised by this function alone.
+        output: How files are put into the sorted tree, one of
+            ``transfer.OUTPUT_MODES``. Duplicates in the plan are only deleted
+            or linked when moving, and are skipped otherwise.
+        index: An index of ``out``, so that the sorted tree isn't scanned again
+            for each plan, e.g. while watching. It is kept up to date with the
+            files moved. Created if None.
+
+    Returns:
+        The folders of the sorted tree that files were moved into, like
+        ``"2019/07"``
+    """
+    if not out.is_dir():
+        raise ValueError("out path is not a directory")
+
+    if index is None:
+        index = DestinationIndex(out)
+
+    if journal and journal.output != output:
+        raise ValueError("Journal is for a different output mode", journal.output)
+
+    if journal:
+        resumed = list()
+        for source, destination in journal.reconcile():
+            destination = Path(os.path.relpath(destination, out)).as_posix()
+            resumed.append(PlannedMove(source, destination, None, "journal"))
+
+        logging.info("Resuming %s interrupted moves", len(resumed))
+        moves = itertools.chain(resumed, moves)
+
+    # The sizes of the files being moved, by source
+    sizes = dict()
+
+    def finish(move: transfer.Transfer):
+        if journal:
+            journal.finish(move.source, move.destination, move.error is None)
+
+        size = sizes.pop(move.source, None)
+
+        if move.error:
+            destination = Path(move.destination)
+            logging.error("Failed to move file %s. Skipping.", destination.name)
+            logging.error("%s", move.error)
+
+            month = destination.parent
+            index.remove(month.parent.name, month.name, destination.name)
+            progress.add_failed()
+        else:
+            progress.add_moved(size)
+
+    folders = set()
+
+    with (
+        transfer.Mover(out, workers=copy_workers, output=output) as mover,
+        nullcontext(deduplicator) if deduplicator else Deduplicator() as deduplicator,
+        nullcontext(progress) if progress else Progress() as progress,
+    ):
+        for move in progress.timed(moves, "plan"):
+            filename = os.path.basename(move.source)
+
+            if move.action == plan.SKIP or not move.destination:
+                logging.warning("Skipping %s: %s", filename, move.reason)
+                progress.add_skipped(move.reason or "no destination")
+                continue
+
+            if journal and os.path.abspath(move.source) in journal.done:
+                logging.debug("Skipping %s: already moved", filename)
+                progress.add_skipped("already moved")
+                continue
+
+            try:
+                year, month, name = _split_destination(move.destination)
+            except ValueError:
+                logging.warning("Skipping %s: invalid destination", filename)
+                progress.add_skipped(f"invalid destination: {move.destination}")
+                continue
+
+            if move.action in (plan.DELETE, plan.LINK) and output != "move":
+                logging.warning("Skipping %s: duplicate, keeping sources", filename)
+                progress.add_skipped(f"duplicate: {move.destination}")
+                continue
+
+            if move.action in (plan.DELETE, plan.LINK):
+                original = out / year / month / name
+
+                with progress.stage("dedup"):
+                    # The original may still be on its way into the sorted tree
+                    if not original.exists():
+                        for done in mover.finished(wait=True):
+                            finish(done)
+
+                    reason = _dispose_duplicate(move, original, deduplicator)
+
+                if reason:
+                    progress.add_skipped(reason)
+                else:
+                    progress.add_duplicate()
+                continue
+
+            logging.debug("Moving %s, date: %s-%s", filename, year, month)
+
+            if index.contains(year, month, name):
+                logging.warning(
+                    "Skipping %s: already exists at out directory", filename
+                )
+                progress.add_skipped("already exists at out directory")
+                continue
+
+            destination = index.folder(year, month) / name
+
+            # The file is added to the index before the move finishes so that
+            # later files can't claim the same name in the meantime
+            if journal:
+                journal.intend(move.source, destination)
+            sizes[move.source] = move.size
+
+            with progress.stage("move"):
+                mover.move(move.source, destination)
+            index.add(year, month, name)
+            folders.add(f"{year}/{month}")
+
+            for done in mover.finished():
+                finish(done)
+
+        with progress.stage("move"):
+            for done in mover.finished(wait=True):
+                finish(done)
+
+    return folders
+
+
+def _dispose_duplicate(
+    move: PlannedMove, original: Path, deduplicator: Deduplicator
+) -> str | None:
+    # Returns why the duplicate was skipped, or None if it was dealt with
+    filename = os.path.basename(move.source)
+
+    # The plan may be out of date, so make sure before getting rid of anything
+    try:
+        identical = deduplicator.same_content(move.source, original)
+    except OSError as err:
+        logging.error("Skipping %s: unable to compare with %s", filename, original)
+        logging.error("%s", err)
+        return "unable to compare with sorted file"
+
+    if not identical:
+        logging.warning("Skipping %s: no longer identical to %s", filename, original)
+        return "no longer identical to sorted file"
+
+    try:
+        if move.action == plan.DELETE:
+            logging.debug("Deleting %s, duplicate of %s", filename, move.destination)
+            os.unlink(move.source)
+        else:
+            logging.debug("Linking %s to %s", filename, move.destination)
+            link_duplicate(move.source, original)
+    except OSError as err:
+        logging.error("Failed to %s duplicate %s. Skipping.", move.action, filename)
+        logging.error("%s", err)
+        return f"failed to {move.action} duplicate"
+
+    return None
+
+
+def benchmark_readers(
+    source: Path, readers: Iterable[str] = probe.READERS, max_files=float("inf")
+) -> Dict[str, float]:
+    """Time how long each metadata reader takes to probe the photos in a
+    directory, without moving anything.
+
+    Each reader probes every file once, one file at a time, so that the timings
+    reflect the cost of the reader rather than of the concurrency. Note that
+    whichever reader goes first may pay for loading the files into the OS
+    cache.
+
+    Args:
+        source: The directory containing the photos
+        readers: The readers to time. See ``probe.READERS``.
+        max_files: The maximum number of files to probe
+
+    Returns:
+        The total seconds taken by each reader
+    """
+    files = list()
+    for file in walker.walk(source):
+        if len(files) >= max_files:
+            break
+        files.append(file)
+
+    timings = dict()
+    for reader in readers:
+        start = time.perf_counter()
+        dated = sum(1 for p in files if probe.probe_file(p, reader).timestamp)
+        timings[reader] = time.perf_counter() - start
 
-        if not out_dir.exists():
-            logging.debug(f"Creating output directory {year}/{month}")
-            os.makedirs(out_dir)
-        if (out_dir / file.name).exists():
-            logging.warning(f"Skipping {filename}: already exists at out directory")
+        logging.info(
+            "%s: %.3fs for %s files, %s dated",
+            reader,
+            timings[reader],
+            len(files),
+            dated,
+        )
 
-        try:
-            shutil.move(file, out_dir)
-        except Exception as err:
-            logging.error(f"Failed to move file {filename}. Skipping.")
-            logging.error(f"{err}")
+    return timings
@@ -1,18 +1,18 @@
 import json
 from typing import Tuple, Dict
-from dateutil import parser
 from datetime import datetime
 
 from .ms_graph import Graph, BatchMoveQueue
 from . import main_log
+from . import timestamps
+from .progress import Progress
 
 logging = main_log.getChild(__name__)
 
-REPORT_PERIOD = 50
-"""How often to log how many files were checked"""
 
-
-def sort_photos(graph: Graph, in_path: str, out_path: str):
+def sort_photos(
+    graph: Graph, in_path: str, out_path: str, progress: Progress | None = None
+):
     """Sort photos using the Microsoft Graph API
 
     Args:
@@ -22,12 +22,14 @@ def sort_photos(graph: Graph, in_path: str, out_path: str):
         out_path: The human-readable path from the OneDrive root to the
         top-level destination folder for the newly sorted photos and the folder
         hierarchy by which they are sorted. Can be the same as ``in_path``.
+        progress: Tracks how sorting is going. If None, a summary is logged
+            once sorting is done.
     """
     in_folder = graph.get_file_id(in_path)
     out_folder = graph.get_file_id(out_path)
 
     all_files = graph.get_file_children(
-        in_folder, select=["name", "id", "file", "photo", "createdDateTime"]
+        in_folder, select=["name", "id", "file", "photo", "createdDateTime", "size"]
     )
 
     subfolder_cache: Dict[str, str] = dict()
@@ -35,18 +37,18 @@ def sort_photos(graph: Graph, in_path: str, out_path: str):
     batch_mover = BatchMoveQueue(graph)
     batch_mover.start()
 
-    moved = 0
-
-    for i, file in enumerate(all_files):
-        if i % REPORT_PERIOD == 0 and i != 0:
-            logging.info(f"{i} files examined")
+    summarise = progress is None
+    progress = progress or Progress()
 
+    for file in progress.timed(all_files, "list"):
         if not should_move(file):
+            progress.add_skipped("not a photo or video")
             continue
 
         try:
             dt = get_timestamp(file)
         except ValueError:
+            progress.add_skipped("no timestamp")
             continue
 
         # Format month and year strings to have leading zeros. If someone
@@ -56,23 +58,26 @@ def sort_photos(graph: Graph, in_path: str, out_path: str):
         subfolder = f"{year}/{month}"
 
         if not (new_loc := subfolder_cache.get(subfolder, None)):
-            logging.debug(f"Ensuring path\t{subfolder}")
+            logging.debug("Ensuring path\t%s", subfolder)
 
-            new_loc = graph.ensure_path(out_folder, [year, month])
+            with progress.stage("folders"):
+                new_loc = graph.ensure_path(out_folder, [year, month])
             subfolder_cache[subfolder] = new_loc
 
-        logging.debug(f"Creating Move task\t{file['id']}")
+        logging.debug("Creating Move task\t%s", file["id"])
 
         batch_mover.put(file["id"], new_loc)
-        moved += 1
+        progress.add_moved(file.get("size"))
 
     batch_mover.done_adding()
     logging.info("Done adding move tasks")
 
-    batch_mover.join()
+    with progress.stage("move"):
+        batch_mover.join()
     logging.info("Moves complete")
 
-    logging.info(f"Sortation complete. {i} files processed, {moved} files moved.")
+    if summarise:
+        progress.summary()
 
 
 def should_move(json_data: dict, allowed_types=["image", "video"]) -> bool:
@@ -141,4 +146,4 @@ def get_timestamp(json_data: dict) -> datetime:
 
         raise ValueError("No timestamp found", name, id)
 
-    return parser.parse(timestamp)
+    return timestamps.parse_iso(timestamp)
@@ -0,0 +1,292 @@
+from contextlib import nullcontext
+from typing import BinaryIO, ContextManager, Dict
+import mmap
+import os
+import struct
+
+HEADER_SIZE = 64 * 1024
+"""Number of bytes read from the start of a file to look for EXIF metadata.
+
+The EXIF segment of a JPEG is limited to 64 KiB and is almost always at the
+very start of the file, so this is usually all that is needed.
+"""
+
+MAX_HEADER_SIZE = 1024 * 1024
+"""The most bytes that will be read looking for EXIF metadata before giving
+up."""
+
+DATETIME = 0x0132
+"""Exif.Image.DateTime, the time the file was last changed"""
+
+DATETIME_ORIGINAL = 0x9003
+"""Exif.Photo.DateTimeOriginal, the time the photo was taken"""
+
+DATETIME_DIGITIZED = 0x9004
+"""Exif.Photo.DateTimeDigitized, the time the photo was stored digitally"""
+
+DATE_TAGS = (DATETIME, DATETIME_ORIGINAL, DATETIME_DIGITIZED)
+
+EXIF_IFD = 0x8769
+"""Pointer from IFD0 to the Exif sub-IFD, where most date tags live"""
+
+_ASCII = 2
+_MAX_IFD_ENTRIES = 1024
+
+JPEG_SIGNATURE = b"\xff\xd8"
+TIFF_SIGNATURES = (b"II*\x00", b"MM\x00*", b"IIRO", b"IIRS", b"IIU\x00")
+"""Signatures of TIFF files, including the TIFF-based raw formats (CR2, NEF,
+ARW, DNG, ...) and the variants used by Olympus (ORF) and Panasonic (RW2)"""
+
+_TIFF_MAGIC = (42, 0x4F52, 0x5352, 0x55)
+_EXIF_HEADER = b"Exif\x00\x00"
+
+
+class ExifError(ValueError):
+    """The buffer doesn't contain EXIF metadata that can be parsed here.
+
+    This doesn't necessarily mean the file has no metadata, just that something
+    more thorough, like PIL, will have to read it.
+    """
+
+
+class TruncatedError(ExifError):
+    """The buffer ends before the EXIF metadata does.
+
+    Attributes:
+        needed: The minimum buffer length needed to continue parsing
+    """
+
+    def __init__(self, needed: int):
+        ExifError.__init__(self, "EXIF metadata truncated", needed)
+        self.needed = needed
+
+
+def _require(buf, end: int):
+    if end > len(buf):
+        raise TruncatedError(end)
+
+
+def parse_tiff(buf, start: int = 0) -> Dict[int, str]:
+    """Read the date tags from a TIFF structure.
+
+    The buffer can be anything supporting the buffer protocol, and only the
+    bytes of the date tags themselves are copied out of it.
+
+    Args:
+        buf: The buffer containing the TIFF structure
+        start: The offset of the TIFF header in ``buf``. All offsets inside
+            the structure are relative to this.
+
+    Returns:
+        The values of any of the ``DATE_TAGS`` found, by tag number
+
+    Raises:
+        ExifError: If the structure is malformed
+    """
+    _require(buf, start + 8)
+    order = bytes(buf[start : start + 2])
+    if order == b"II":
+        endian = "<"
+    elif order == b"MM":
+        endian = ">"
+    else:
+        raise ExifError("Bad TIFF byte order", order)
+
+    magic, ifd = struct.unpack_from(f"{endian}HI", buf, start + 2)
+    if magic not in _TIFF_MAGIC:
+        raise ExifError("Bad TIFF magic number", magic)
+
+    dates = dict()
+    visited = set()
+    pending = [ifd]
+
+    while pending:
+        ifd = pending.pop()
+        if ifd in visited or ifd < 8:
+            continue
+        visited.add(ifd)
+
+        _require(buf, start + ifd + 2)
+        (count,) = struct.unpack_from(f"{endian}H", buf, start + ifd)
+        if count > _MAX_IFD_ENTRIES:
+            raise ExifError("Implausible IFD size", count)
+
+        entries = start + ifd + 2
+        _require(buf, entries + count * 12)
+
+        for i in range(count):
+            tag, kind, length, value = struct.unpack_from(
+                f"{endian}HHII", buf, entries + i * 12
+            )
+
+            if tag == EXIF_IFD:
+                pending.append(value)
+            elif tag in DATE_TAGS and kind == _ASCII and tag not in dates:
+                if length <= 4:
+                    offset = entries + i * 12 + 8
+                else:
+                    offset = start + value
+                _require(buf, offset + length)
+
+                text = bytes(buf[offset : offset + length])
+                dates[tag] = text.split(b"\x00", 1)[0].decode("ascii", "replace")
+
+    return dates
+
+
+def find_jpeg_exif(buf) -> int | None:
+    """Find the start of the TIFF structure in a JPEG's EXIF segment.
+
+    Args:
+        buf: A buffer beginning with the start of a JPEG file
+
+    Returns:
+        The offset of the TIFF header in ``buf``, or None if the JPEG has no
+        EXIF segment
+
+    Raises:
+        ExifError: If the buffer isn't a JPEG or the markers are malformed
+    """
+    if bytes(buf[:2]) != JPEG_SIGNATURE:
+        raise ExifError("Not a JPEG")
+
+    pos = 2
+    while True:
+        _require(buf, pos + 2)
+        if buf[pos] != 0xFF:
+            raise ExifError("Bad JPEG marker", pos)
+
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a payload
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of the image data, so no more metadata
+            return None
+
+        _require(buf, pos + 4)
+        (length,) = struct.unpack_from(">H", buf, pos + 2)
+        end = pos + 2 + length
+
+        if marker == 0xE1:
+            _require(buf, pos + 10)
+            if bytes(buf[pos + 4 : pos + 10]) == _EXIF_HEADER:
+                return pos + 10
+
+        pos = end
+
+
+def open_binary(file: str | os.PathLike | BinaryIO) -> ContextManager[BinaryIO]:
+    """Open a file for reading, or use one that is already open, which is left
+    open. This way a file can be opened once and handed to several readers.
+
+    Args:
+        file: The path to the file, or the open file
+    """
+    if hasattr(file, "read"):
+        return nullcontext(file)
+    return open(file, mode="rb")
+
+
+def read_dates(buf) -> Dict[int, str]:
+    """Read the date tags from the start of a JPEG, TIFF or TIFF-based raw
+    file.
+
+    Args:
+        buf: A buffer beginning with the start of the file
+
+    Returns:
+        The values of any of the ``DATE_TAGS`` found, by tag number
+
+    Raises:
+        TruncatedError: If more of the file is needed
+        ExifError: If the file isn't a JPEG or TIFF, or is malformed
+    """
+    signature = bytes(buf[:4])
+
+    if signature[:2] == JPEG_SIGNATURE:
+        start = find_jpeg_exif(buf)
+        if start is None:
+            return dict()
+        return parse_tiff(buf, start)
+
+    if signature in TIFF_SIGNATURES:
+        return parse_tiff(buf)
+
+    raise ExifError("Unsupported file type", signature)
+
+
+def read_exif_dates(
+    path: str | os.PathLike | BinaryIO, header: bytes = b""
+) -> Dict[int, str]:
+    """Read the date tags of a JPEG, TIFF or TIFF-based raw file from its
+    header.
+
+    Only the first ``HEADER_SIZE`` bytes are read, unless the metadata extends
+    further into the file.
+
+    Args:
+        path: The path to the file, or the open file
+        header: The start of the file, if it has already been read, so it
+            isn't read again
+
+    Returns:
+        The values of any of the ``DATE_TAGS`` found, by tag number
+
+    Raises:
+        ExifError: If the metadata can't be read this way
+        OSError: If the file can't be read
+    """
+    with open_binary(path) as f:
+        if header:
+            buf = header
+            f.seek(len(header))
+        else:
+            f.seek(0)
+            buf = f.read(HEADER_SIZE)
+
+        while True:
+            try:
+                return read_dates(buf)
+            except TruncatedError as err:
+                if err.needed > MAX_HEADER_SIZE:
+                    raise
+                more = f.read(max(err.needed, len(buf) * 2) - len(buf))
+                if not more:
+                    raise
+                buf += more
+
+
+def read_exif_dates_mmap(path: str | os.PathLike | BinaryIO) -> Dict[int, str]:
+    """Read the date tags of a JPEG or TIFF file by memory-mapping it.
+
+    The metadata is parsed in place through a ``memoryview`` of the mapping, so
+    the only bytes copied are those of the date tags. This is fastest for large
+    files on local storage, where it avoids reading through file buffers.
+
+    Args:
+        path: The path to the file, or the open file
+
+    Returns:
+        The values of any of the ``DATE_TAGS`` found, by tag number
+
+    Raises:
+        ExifError: If the metadata can't be read this way
+        OSError: If the file can't be read
+    """
+    with open_binary(path) as f:
+        try:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            raise ExifError("Empty file")
+
+    with mapping:
+        # The view must be released before the mapping can be closed
+        with memoryview(mapping) as view:
+            return read_dates(view)
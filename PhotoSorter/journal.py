@@ -0,0 +1,242 @@
+from typing import Dict, Iterator, Set, Tuple
+import glob
+import json
+import os
+import time
+
+from . import main_log
+
+logging = main_log.getChild(__name__)
+
+SYNC_PERIOD = 256
+"""Number of journal records written between flushes to disk"""
+
+SYNC_INTERVAL = 2.0
+"""Maximum seconds between flushes of the journal to disk while moves are being
+recorded"""
+
+FORMAT_VERSION = 1
+"""Version of the journal file format"""
+
+INTENT = "intent"
+DONE = "done"
+FAILED = "failed"
+
+
+class MoveJournal:
+    """An append-only record of the moves made while sorting, so that an
+    interrupted run can be resumed without examining every file again.
+
+    Each move is recorded before it starts and again once it has finished.
+    Records are flushed to disk in batches, so a crash loses at most the last
+    batch, which ``reconcile`` can work out from the file system.
+
+    Paths are recorded as absolute paths. The journal starts with a header
+    recording the output mode of the run, since what an interrupted move left
+    behind means something different for each mode.
+    """
+
+    def __init__(self, path: str | os.PathLike, output: str = "move"):
+        """Open a journal, reading the records of any earlier, interrupted run.
+
+        Args:
+            path: The file holding the journal. Created if it doesn't exist.
+            output: The output mode of the run, one of
+                ``transfer.OUTPUT_MODES``
+
+        Raises:
+            ValueError: If the journal was written by a run with a different
+                output mode
+        """
+        self.path = os.fspath(path)
+        self.output = output
+
+        # Journals written before the header was added were all moving files
+        self._recorded_output = "move"
+
+        self.done: Set[str] = set()
+        """The source paths of all moves known to have finished"""
+
+        # Moves that were started but not known to have finished, by source
+        self._incomplete: Dict[str, str] = dict()
+
+        truncated = False
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if exists:
+            truncated = self._load()
+
+            if self._recorded_output != output:
+                raise ValueError(
+                    "Journal was written with a different output mode",
+                    self._recorded_output,
+                )
+
+            logging.info(
+                "Resuming from journal: %s moves done, %s unfinished",
+                len(self.done),
+                len(self._incomplete),
+            )
+
+        self._file = open(self.path, mode="a", encoding="utf-8")
+        if truncated:
+            # Don't let the first new record run on from a cut off one
+            self._file.write("\n")
+        if not exists:
+            header = {"photo_sorter_journal": FORMAT_VERSION, "output": output}
+            self._file.write(json.dumps(header) + "\n")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _load(self) -> bool:
+        line = ""
+        with open(self.path, mode="r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if isinstance(record, dict):
+                        self._recorded_output = record.get("output", "move")
+                        continue
+
+                    kind, source, destination = record
+                except ValueError:
+                    # The last record may have been cut off by a crash
+                    continue
+
+                if kind == INTENT:
+                    self._incomplete[source] = destination
+                else:
+                    self._incomplete.pop(source, None)
+                    if kind == DONE:
+                        self.done.add(source)
+
+        return bool(line) and not line.endswith("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _record(self, kind: str, source: str, destination: str):
+        self._file.write(json.dumps([kind, source, destination]) + "\n")
+
+        self._unsynced += 1
+        if (
+            self._unsynced >= SYNC_PERIOD
+            or time.monotonic() - self._last_sync > SYNC_INTERVAL
+        ):
+            self.sync()
+
+    def intend(self, source: str | os.PathLike, destination: str | os.PathLike):
+        """Record that a move is about to start.
+
+        Args:
+            source: The file being moved
+            destination: The new path of the file
+        """
+        source = os.path.abspath(source)
+        destination = os.path.abspath(destination)
+
+        self._incomplete[source] = destination
+        self._record(INTENT, source, destination)
+
+    def finish(
+        self,
+        source: str | os.PathLike,
+        destination: str | os.PathLike,
+        succeeded: bool = True,
+    ):
+        """Record that a move has finished.
+
+        Args:
+            source: The file that was moved
+            destination: The new path of the file
+            succeeded: Whether the file was actually moved
+        """
+        source = os.path.abspath(source)
+
+        self._incomplete.pop(source, None)
+        if succeeded:
+            self.done.add(source)
+
+        self._record(
+            DONE if succeeded else FAILED, source, os.path.abspath(destination)
+        )
+
+    def reconcile(self) -> Iterator[Tuple[str, str]]:
+        """Work out what happened to the moves that were interrupted.
+
+        Moves that actually finished are recorded as such, and leftovers of
+        interrupted copies are removed. Nothing needs to be probed again, since
+        the journal knows where each file was going. When files were being
+        linked or copied rather than moved, a source and destination both
+        existing means the move finished, and the source is kept.
+
+        Yields:
+            The (source, destination) of each move that must be started again
+        """
+        for source, destination in list(self._incomplete.items()):
+            # Interrupted copies leave temporary files behind
+            directory, name = os.path.split(destination)
+            for temp in glob.glob(
+                os.path.join(glob.escape(directory), f".{glob.escape(name)}.*.partial")
+            ):
+                logging.debug("Removing partial copy %s", temp)
+                os.unlink(temp)
+
+            source_exists = os.path.exists(source)
+            destination_exists = os.path.exists(destination)
+
+            if destination_exists and not source_exists:
+                self.finish(source, destination)
+            elif destination_exists and self.output != "move":
+                self.finish(source, destination)
+            elif destination_exists:
+                # Copies are only renamed into place once complete, so the
+                # move was only missing the removal of the source
+                if self._is_copy(source, destination):
+                    os.unlink(source)
+                    self.finish(source, destination)
+                else:
+                    logging.warning("%s already exists, not moving", destination)
+                    self.finish(source, destination, succeeded=False)
+            elif source_exists:
+                yield source, destination
+            else:
+                logging.warning("%s is missing, it may have been moved", source)
+                self.finish(source, destination, succeeded=False)
+
+    @staticmethod
+    def _is_copy(source: str, destination: str) -> bool:
+        # Whether the source can safely be removed, leaving the destination.
+        # A link to the source would be left dangling.
+        if os.path.islink(destination):
+            return False
+
+        try:
+            if os.path.samefile(source, destination):
+                # A hard link, which keeps the data
+                return True
+            return os.path.getsize(source) == os.path.getsize(destination)
+        except OSError:
+            return False
+
+    def sync(self):
+        """Flush all records to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """Flush all records to disk and close the journal."""
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def discard(self):
+        """Close and delete the journal, e.g. once a run has finished and there
+        is nothing left to resume."""
+        self.close()
+        os.unlink(self.path)
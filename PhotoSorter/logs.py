@@ -0,0 +1,129 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import logging as _logging
+import os
+import queue
+import sys
+
+from . import main_log
+
+LOG_FILE = "photo-sorter.log"
+"""Default file the log is written to"""
+
+LEVEL_VARIABLE = "PHOTO_SORTER_LOG_LEVEL"
+"""Environment variable setting the level of the log, e.g. ``DEBUG``"""
+
+DEFAULT_LEVEL = _logging.INFO
+"""Default level of the log. Per-file messages are logged at DEBUG, which on
+large runs makes for a very large log, so they are left out by default."""
+
+MAX_BYTES = 64 * 1024 * 1024
+"""Size at which the log file is rotated"""
+
+BACKUP_COUNT = 5
+"""Number of rotated log files kept, including those of earlier runs"""
+
+FILE_FORMAT = "%(asctime)s\t%(levelname)s\t%(name)s\t%(message)s"
+
+_listener: QueueListener | None = None
+_handler: QueueHandler | None = None
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # The records stay in this process, so there's no need to format them
+    # before they're queued. This leaves all the formatting to the listener's
+    # thread.
+    def prepare(self, record):
+        return record
+
+
+def configure(
+    level: int | str | None = None,
+    path: str | os.PathLike | None = LOG_FILE,
+    console_level: int | str = _logging.INFO,
+    max_bytes: int = MAX_BYTES,
+    backup_count: int = BACKUP_COUNT,
+):
+    """Send the log to a file and the console without slowing down sorting.
+
+    Logging calls only put records on a queue. A background thread formats
+    them and writes them out. The log file is rotated when it grows past
+    ``max_bytes``, and at the start of every run, so each run starts a new
+    file.
+
+    Configuring again replaces the previous configuration.
+
+    Args:
+        level: The level of messages logged, e.g. ``"DEBUG"``. Taken from the
+            ``PHOTO_SORTER_LOG_LEVEL`` environment variable if None, and
+            otherwise ``DEFAULT_LEVEL``.
+        path: The file to write the log to. Not written to a file if None.
+        console_level: The level of messages also printed to the console
+        max_bytes: The size at which the log file is rotated
+        backup_count: The number of rotated log files to keep
+    """
+    global _listener, _handler
+
+    shutdown()
+
+    handlers = list()
+
+    if path is not None:
+        file_handler = RotatingFileHandler(
+            path,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            file_handler.doRollover()
+
+        file_handler.setFormatter(_logging.Formatter(FILE_FORMAT))
+        handlers.append(file_handler)
+
+    console_handler = _logging.StreamHandler(stream=sys.stdout)
+    console_handler.setLevel(console_level)
+    console_handler.setFormatter(_logging.Formatter("%(message)s"))
+    handlers.append(console_handler)
+
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    _handler = _DeferredQueueHandler(records)
+    main_log.addHandler(_handler)
+
+    set_level(level or os.environ.get(LEVEL_VARIABLE) or DEFAULT_LEVEL)
+
+
+def set_level(level: int | str):
+    """Change the level of the log while running.
+
+    Messages below this level are dropped before they're formatted, so they
+    cost next to nothing.
+
+    Args:
+        level: The new level, e.g. ``logging.DEBUG`` or ``"DEBUG"``
+    """
+    if isinstance(level, str):
+        level = level.upper()
+    main_log.setLevel(level)
+
+
+def shutdown():
+    """Write out all queued messages and stop the background thread."""
+    global _listener, _handler
+
+    if _handler is not None:
+        main_log.removeHandler(_handler)
+        _handler = None
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown)
@@ -53,7 +53,7 @@ class Graph:
 
         r = requests.request(method, *args, **kwargs)
 
-        logging.debug(f"{method}\t{r.url}\t{kwargs.get('json', '')!s:.100}")
+        logging.debug("%s\t%s\t%.100s", method, r.url, kwargs.get("json", ""))
 
         self.total_requests_made += 1
         data = r.json()
@@ -205,7 +205,9 @@ class Graph:
             # but all of the values are empty. Short-circut and stop after
             # several empty pages of results
             if empty_results >= EMPTY_LIMIT:
-                logging.warn("Too many pages of empty results of children. Stopping.")
+                logging.warning(
+                    "Too many pages of empty results of children. Stopping."
+                )
                 break
 
             r = self.request_wrapper("GET", json["@odata.nextLink"], headers=header)
@@ -218,8 +220,8 @@ class Graph:
 
             if len(json["value"]) == 0:
                 empty_results += 1
-                logging.warn(
-                    f"Empty children result page encountered, count: {empty_results}"
+                logging.warning(
+                    "Empty children result page encountered, count: %s", empty_results
                 )
 
             yield from iter(json["value"])
@@ -247,7 +249,7 @@ class Graph:
             "@microsoft.graph.conflictBehavior": "fail",
         }
 
-        logging.debug(f"Moving file\t{file_id}")
+        logging.debug("Moving file\t%s", file_id)
 
         r = self.request_wrapper("PATCH", url, headers=header, json=content)
 
@@ -337,12 +339,12 @@ class BatchMoveQueue(threading.Thread):
         self.__stop = threading.Event()
 
     def put(self, file_id: str, new_parent: str):
-        logging.debug(f"Put item in queue\t{file_id}")
+        logging.debug("Put item in queue\t%s", file_id)
         if not self.__stop.is_set():
             self._q.put(BatchMoveQueue.MoveOrder(file_id, new_parent))
 
     def done_adding(self):
-        logging.debug(f"Queue stop condition set")
+        logging.debug("Queue stop condition set")
         self.__stop.set()
 
     def run(self):
@@ -364,7 +366,7 @@ class BatchMoveQueue(threading.Thread):
                 else:
                     break
 
-                logging.debug(f"Adding item to batch\t{file_id}")
+                logging.debug("Adding item to batch\t%s", file_id)
 
                 requests.append(
                     {
@@ -381,7 +383,9 @@ class BatchMoveQueue(threading.Thread):
                 counter += 1
 
             logging.info(
-                f"Moving batch of {counter} images now. Approximately {self._q.qsize()} more images in queue."
+                "Moving batch of %s images now. Approximately %s more images in queue.",
+                counter,
+                self._q.qsize(),
             )
 
             r = self.graph.request_wrapper(
@@ -393,7 +397,7 @@ class BatchMoveQueue(threading.Thread):
             if r.status_code != 200:
                 err = r.json()["error"]
                 message = err["message"]
-                logging.warn(f"Error processing batch: {message}")
+                logging.warning("Error processing batch: %s", message)
 
             if not r.json().get("responses") and counter == 0:
                 continue
@@ -404,7 +408,7 @@ class BatchMoveQueue(threading.Thread):
                     err = body["error"]
                     error_code = err["code"]
                     message = err["message"]
-                    logging.warn(f"Failed to move file: {message}")
+                    logging.warning("Failed to move file: %s", message)
 
                 try:
                     self._q.task_done()
@@ -0,0 +1,363 @@
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from math import comb
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+import itertools
+import os
+
+from . import main_log
+from . import walker
+
+logging = main_log.getChild(__name__)
+
+try:
+    import numpy
+except ImportError:
+    # Near-duplicates are found with a BK-tree instead, which is slower
+    numpy = None
+
+HASH_SIZE = 8
+"""Width and height of the grid a perceptual hash is computed from. The hash
+has ``HASH_SIZE ** 2`` bits."""
+
+DEFAULT_THRESHOLD = 8
+"""Default maximum number of differing bits between the perceptual hashes of
+two photos for them to count as near-duplicates"""
+
+# Widest band of the hashes indexed by near_pairs. Each band is indexed with a
+# table of 2 ** width entries.
+_MAX_BAND_WIDTH = 22
+
+DEFAULT_WORKERS = 4
+"""Default number of photos hashed at once"""
+
+BLOCK_SIZE = 1024
+"""Number of hashes compared against all others at once when NumPy compares
+every pair of hashes, which it only does for few hashes. This bounds the memory
+used to ``BLOCK_SIZE`` times the number of hashes, in 8-byte integers."""
+
+
+def perceptual_hash(path: str | os.PathLike) -> int:
+    """Compute the difference hash of a photo.
+
+    The photo is shrunk to a small grayscale grid, and each bit of the hash
+    records whether a pixel is brighter than its neighbour. Resized, recompressed
+    and slightly edited copies of a photo have hashes differing in few bits.
+
+    JPEGs are decoded at a reduced size, which is much faster than decoding
+    them fully.
+
+    Args:
+        path: The photo to hash
+
+    Raises:
+        OSError: If the photo can't be opened
+    """
+    with Image.open(path) as image:
+        image.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+        small = image.convert("L").resize(
+            (HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR
+        )
+
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+
+    return value
+
+
+def hash_photos(
+    paths: Iterable[str | os.PathLike], workers: int = DEFAULT_WORKERS
+) -> Dict[str, int]:
+    """Compute the perceptual hashes of many photos in parallel.
+
+    Files that can't be opened as images are left out.
+
+    Args:
+        paths: The photos to hash
+        workers: The number of photos to hash at once
+
+    Returns:
+        The hash of each photo, by path
+    """
+
+    def try_hash(path):
+        try:
+            return path, perceptual_hash(path)
+        except Exception:
+            return path, None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="phash") as e:
+        results = e.map(try_hash, map(os.fspath, paths))
+        return {path: value for path, value in results if value is not None}
+
+
+class BKTree:
+    """A tree of integers indexed by the Hamming distance between them, which
+    finds all values near a given one without comparing against every value.
+
+    This is only used when NumPy isn't available.
+    """
+
+    def __init__(self):
+        # Each node is [value, item, {distance: child}]
+        self._root = None
+
+    def add(self, value: int, item):
+        """Add a value to the tree.
+
+        Args:
+            value: The value to index
+            item: Returned by ``search`` when this value matches
+        """
+        if self._root is None:
+            self._root = [value, item, dict()]
+            return
+
+        node = self._root
+        while True:
+            distance = (value ^ node[0]).bit_count()
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, item, dict()]
+                return
+            node = child
+
+    def search(self, value: int, threshold: int) -> Iterator:
+        """Find the items whose values are within a distance of a value.
+
+        Args:
+            value: The value to search near
+            threshold: The maximum Hamming distance
+        """
+        if self._root is None:
+            return
+
+        pending = [self._root]
+        while pending:
+            node = pending.pop()
+            distance = (value ^ node[0]).bit_count()
+
+            if distance <= threshold:
+                yield node[1]
+
+            for d, child in node[2].items():
+                if distance - threshold <= d <= distance + threshold:
+                    pending.append(child)
+
+
+def _popcount(values):
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(values)
+
+    # Older versions of NumPy can't count bits, so count them a byte at a time
+    table = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+    counts = table[values.view(numpy.uint8)]
+    return counts.reshape(values.shape + (8,)).sum(axis=-1, dtype=numpy.uint8)
+
+
+def _bands(count: int, threshold: int) -> Tuple[List[Tuple[int, int]], int]:
+    # Chooses how to split the bits of the hashes into bands, returning the
+    # (shift, width) of each band and the maximum distance searched within a
+    # band, or no bands if comparing every pair of hashes is cheaper.
+    #
+    # Two hashes within the threshold differ in at most threshold // bands
+    # bits of at least one band. Each hash is looked up under every value near
+    # each of its bands, so wider bands mean more lookups, but fewer hashes
+    # sharing each value to check. The cost is counted in operations on whole
+    # arrays of hashes.
+    best, best_cost = 0, count / 2
+    for bands in range(-(-64 // _MAX_BAND_WIDTH), 65):
+        width = -(-64 // bands)
+        lookups = sum(comb(width, bits) for bits in range(threshold // bands + 1))
+        cost = bands * (2**width / count + lookups * (3 + 10 * count / 2**width))
+        if cost < best_cost:
+            best, best_cost = bands, cost
+
+    if not best:
+        return [], 0
+
+    # Split the bits as evenly as possible
+    widths = [64 // best + (band < 64 % best) for band in range(best)]
+    shifts = [sum(widths[band + 1 :]) for band in range(best)]
+    return list(zip(shifts, widths)), threshold // best
+
+
+def _compare_all(packed, threshold: int) -> Iterator[Tuple[int, int]]:
+    columns = numpy.arange(len(packed))
+
+    for start in range(0, len(packed), BLOCK_SIZE):
+        block = packed[start : start + BLOCK_SIZE]
+        distances = _popcount(block[:, None] ^ packed[None, :])
+
+        # Only look at pairs above the diagonal so each pair is found once
+        rows = numpy.arange(start, start + len(block))
+        near = (distances <= threshold) & (columns[None, :] > rows[:, None])
+
+        for i, j in zip(*numpy.nonzero(near)):
+            yield start + int(i), int(j)
+
+
+def near_pairs(
+    hashes: Sequence[int], threshold: int = DEFAULT_THRESHOLD
+) -> Iterator[Tuple[int, int]]:
+    """Find all pairs of hashes within a Hamming distance of each other.
+
+    With NumPy, the hashes are split into bands, and each band is indexed by
+    its value (multi-index hashing). Only hashes which are close in some band
+    are compared, rather than every pair, and few hashes are simply all
+    compared with each other. Without NumPy, a BK-tree is used.
+
+    The work still grows faster than the number of hashes: with the default
+    threshold, 200,000 random hashes take seconds, but a million take minutes.
+    Photos are only compared within a month, which is far fewer.
+
+    Args:
+        hashes: The 64-bit hashes
+        threshold: The maximum number of differing bits
+
+    Yields:
+        The indices ``(i, j)``, with ``i < j``, of each pair of near hashes
+    """
+    if numpy is None:
+        tree = BKTree()
+        for j, value in enumerate(hashes):
+            for i in tree.search(value, threshold):
+                yield i, j
+            tree.add(value, j)
+        return
+
+    packed = numpy.fromiter(hashes, dtype=numpy.uint64, count=len(hashes))
+    bands, radius = _bands(len(packed), threshold)
+    if not bands:
+        yield from _compare_all(packed, threshold)
+        return
+
+    keys = [
+        ((packed >> numpy.uint64(shift)) & numpy.uint64((1 << width) - 1)).astype(
+            numpy.int64
+        )
+        for shift, width in bands
+    ]
+
+    for band, (_, width) in enumerate(bands):
+        # The hashes sorted by the value of the band, and where each value
+        # starts and how many hashes have it
+        order = numpy.argsort(keys[band], kind="stable")
+        counts = numpy.bincount(keys[band], minlength=1 << width)
+        starts = numpy.cumsum(counts) - counts
+
+        # Every value within the radius of a band value
+        flips = [
+            sum(1 << bit for bit in bits)
+            for n in range(radius + 1)
+            for bits in itertools.combinations(range(width), n)
+        ]
+
+        for flip in flips:
+            wanted = keys[band] ^ flip
+            hits = numpy.flatnonzero(counts[wanted])
+            if not len(hits):
+                continue
+
+            # Every hash paired with each hash having the value it looked for
+            wanted = wanted[hits]
+            found = counts[wanted]
+            first = numpy.cumsum(found) - found
+            i = numpy.repeat(hits, found)
+            j = numpy.repeat(starts[wanted] - first, found)
+            j = order[j + numpy.arange(len(j))]
+
+            keep = i < j
+            i, j = i[keep], j[keep]
+            keep = _popcount(packed[i] ^ packed[j]) <= threshold
+
+            # Pairs close in an earlier band were found there already
+            for earlier in range(band):
+                keep &= _popcount(keys[earlier][i] ^ keys[earlier][j]) > radius
+
+            for pair in zip(i[keep].tolist(), j[keep].tolist()):
+                yield pair
+
+
+def group_near_duplicates(
+    hashes: Dict[str, int], threshold: int = DEFAULT_THRESHOLD
+) -> List[List[str]]:
+    """Group photos whose perceptual hashes are near each other.
+
+    Groups are transitive: if A is near B and B is near C, all three are in the
+    same group even if A isn't near C.
+
+    Args:
+        hashes: The hash of each photo, by path
+        threshold: The maximum number of differing bits between near photos
+
+    Returns:
+        The groups of at least two photos
+    """
+    paths = list(hashes)
+    parents = list(range(len(paths)))
+
+    def root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, j in near_pairs([hashes[path] for path in paths], threshold):
+        parents[root(i)] = root(j)
+
+    groups = dict()
+    for i, path in enumerate(paths):
+        groups.setdefault(root(i), list()).append(path)
+
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_near_duplicates(
+    out: str | os.PathLike,
+    folders: Iterable[str] | None = None,
+    threshold: int = DEFAULT_THRESHOLD,
+    workers: int = DEFAULT_WORKERS,
+) -> Dict[str, List[List[str]]]:
+    """Find groups of near-duplicate photos in each folder of a sorted file
+    tree.
+
+    Only photos in the same year and month folder are compared, since copies of
+    a photo are dated the same.
+
+    Args:
+        out: The top-level folder of the sorted file tree
+        folders: The folders to search, like ``"2019/07"``. All year and month
+            folders are searched if None.
+        threshold: The maximum number of differing bits between the perceptual
+            hashes of near-duplicate photos
+        workers: The number of photos hashed at once
+
+    Returns:
+        The groups of near-duplicates found in each folder, by folder
+    """
+    if folders is None:
+        folders = [
+            f"{year.name}/{month.name}"
+            for year in os.scandir(out)
+            if year.name.isdigit() and year.is_dir()
+            for month in os.scandir(year.path)
+            if month.name.isdigit() and month.is_dir()
+        ]
+
+    found = dict()
+    for folder in sorted(folders):
+        files = walker.walk(os.path.join(out, folder), recursive=False)
+        groups = group_near_duplicates(hash_photos(files, workers), threshold)
+
+        if groups:
+            found[folder] = groups
+            for group in groups:
+                names = ", ".join(os.path.basename(path) for path in group)
+                logging.info("Near duplicates in %s: %s", folder, names)
+
+    return found
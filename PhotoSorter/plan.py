@@ -0,0 +1,133 @@
+from collections import namedtuple
+from typing import Iterable, Iterator
+import json
+import os
+
+from . import main_log
+
+logging = main_log.getChild(__name__)
+
+FORMAT_VERSION = 1
+"""Version of the move plan file format, so that old plans aren't misread if
+the format changes."""
+
+MOVE = "move"
+"""Move the file to its destination"""
+
+SKIP = "skip"
+"""Leave the file where it is"""
+
+DELETE = "delete"
+"""Delete the file, since it is identical to the file at its destination"""
+
+LINK = "link"
+"""Replace the file with a hard link to the identical file at its destination"""
+
+PlannedMove = namedtuple(
+    "PlannedMove",
+    ["source", "destination", "size", "reason", "action"],
+    defaults=[MOVE],
+)
+"""One entry of a move plan.
+
+``source`` is the path of the file, ``destination`` is a path relative to the
+top of the sorted file tree, using forward slashes (e.g.
+``2019/07/IMG_0001.JPG``), and ``size`` is the size of the file in bytes.
+``action`` is what to do with the file: ``MOVE`` it to the destination,
+``DELETE`` it or ``LINK`` it because the destination is a copy of it, or
+``SKIP`` it, in which case ``destination`` is None. ``reason`` explains why.
+"""
+
+
+def write_plan(moves: Iterable[PlannedMove], path: str | os.PathLike) -> int:
+    """Write a move plan to a file, one move at a time.
+
+    The plan is written as JSON lines: a header object followed by one array
+    per move. This means plans can be written and read without holding the
+    whole plan in memory, and can be inspected or edited with ordinary text
+    tools.
+
+    Args:
+        moves: The moves making up the plan
+        path: The file to write the plan to
+
+    Returns:
+        The number of moves written
+    """
+    count = 0
+
+    with open(path, mode="w", encoding="utf-8") as f:
+        f.write(json.dumps({"photo_sorter_plan": FORMAT_VERSION}) + "\n")
+
+        for move in moves:
+            f.write(json.dumps(list(move), ensure_ascii=False) + "\n")
+            count += 1
+
+    logging.info("Wrote plan of %s moves to %s", count, path)
+    return count
+
+
+def _parse_move(line: str) -> PlannedMove:
+    # Plans may have been edited by hand, so a move is only read if each field
+    # has the type execute_plan expects
+    record = json.loads(line)
+    if not isinstance(record, list) or len(record) not in (4, 5):
+        raise ValueError("Expected a list of 4 or 5 fields", record)
+
+    move = PlannedMove(*record)
+    if not isinstance(move.source, str):
+        raise ValueError("Source is not a path", move.source)
+    if not isinstance(move.destination, (str, type(None))):
+        raise ValueError("Destination is not a path", move.destination)
+    if not isinstance(move.size, (int, type(None))) or isinstance(move.size, bool):
+        raise ValueError("Size is not a number", move.size)
+    if not isinstance(move.reason, (str, type(None))):
+        raise ValueError("Reason is not text", move.reason)
+    if move.action not in (MOVE, SKIP, DELETE, LINK):
+        raise ValueError("Unknown action", move.action)
+
+    return move
+
+
+def read_plan(path: str | os.PathLike) -> Iterator[PlannedMove]:
+    """Read a move plan written by ``write_plan``, one move at a time.
+
+    Lines that aren't valid moves, e.g. because the plan was edited by hand,
+    are logged and skipped.
+
+    Args:
+        path: The file containing the plan
+
+    Raises:
+        ValueError: If the file isn't a move plan this version understands
+    """
+    with open(path, mode="r", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+            version = header["photo_sorter_plan"]
+        except (ValueError, TypeError, KeyError):
+            raise ValueError("Not a move plan", path)
+
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported move plan version", version)
+
+        # The header is line 1
+        for number, line in enumerate(f, start=2):
+            if not line.strip():
+                continue
+
+            try:
+                yield _parse_move(line)
+            except ValueError as err:
+                logging.warning("Skipping line %s of %s: %s", number, path, err)
+
+
+def count_moves(path: str | os.PathLike) -> int:
+    """Count the moves in a plan written by ``write_plan`` without parsing them.
+
+    Args:
+        path: The file containing the plan
+    """
+    with open(path, mode="rb") as f:
+        # Don't count the header
+        return sum(1 for line in f if line.strip()) - 1
@@ -0,0 +1,467 @@
+from PIL import Image, ExifTags
+from collections import deque, namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+import os
+import re
+
+from . import main_log
+from . import bmff
+from . import exif
+from . import sniff
+from . import timestamps
+
+logging = main_log.getChild(__name__)
+
+DEFAULT_WORKERS = 8
+"""Default number of files probed concurrently.
+
+Probing is dominated by waiting on storage (especially network storage), not by
+the CPU, so it pays to have more files in flight than there are cores.
+"""
+
+DEFAULT_CHUNKSIZE = 32
+"""Number of files handed to a worker process at once in process mode.
+
+Sending files in chunks amortizes the cost of passing work to and results back
+from the worker processes.
+"""
+
+EXECUTION_MODES = ("thread", "process")
+"""The ways files can be probed concurrently.
+
+``thread`` probes files in threads of this process, which is best when probing
+is waiting on storage. ``process`` probes files in worker processes, which is
+best when parsing the image metadata is CPU-bound (e.g. large TIFFs), since it
+isn't limited by the GIL.
+"""
+
+READERS = ("header", "mmap", "pil")
+"""The ways the EXIF metadata of a file can be read.
+
+``header`` reads just the start of the file, ``mmap`` memory-maps the file and
+parses it in place, and ``pil`` opens the file as an image with PIL. The first
+two fall back to PIL for files they can't parse.
+"""
+
+WINDOW_FACTOR = 4
+"""How many results per worker may be waiting to be consumed before probing
+pauses. This bounds memory use when moving is slower than probing."""
+
+UNREADABLE = "Unable to read file"
+"""The reason given for files that couldn't be read at all. Since this is
+likely a temporary problem, such results aren't worth remembering."""
+
+NO_TIMESTAMP = "Unable to retrieve timestamp"
+"""The reason given for photos and videos that have no timestamp"""
+
+NOT_MEDIA = "Not a photo or video"
+"""The reason given for files whose first bytes don't match any kind of photo
+or video, which are skipped without being parsed"""
+
+SOURCES = ("filename", "exif", "container", "mtime")
+"""The places the time a file was taken can be found.
+
+``filename`` is the timestamp in the name of the file, like
+``IMG_20190704_153000.jpg`` (see ``timestamps.FILENAME_PATTERNS``), which is
+found without touching the file. It is only used for files named like photos
+and videos (see ``sniff.MEDIA_EXTENSIONS``). ``exif`` is the EXIF metadata of photos,
+including HEIF and CR3 photos, and ``container`` the creation time in the
+metadata of videos. ``mtime`` is when the file was last modified, which is
+often when it was copied rather than when it was taken, so it is only used for
+photos and videos without a timestamp of their own when it comes after
+``exif`` and ``container``.
+"""
+
+DEFAULT_SOURCES = ("filename", "exif", "container")
+"""The sources tried by default, in order"""
+
+CONFIDENCE = {
+    "exif": "high",
+    "container": "high",
+    "filename": "medium",
+    "mtime": "low",
+}
+"""How far the timestamps from each of the ``SOURCES`` can be trusted"""
+
+# Sources that don't need the file to be opened, so they're tried before the
+# file is handed to a worker, or once its metadata turned out to be undated
+_CHEAP_SOURCES = ("filename", "mtime")
+
+# Reasons meaning a file is a photo or video, but its metadata has no usable
+# timestamp
+_UNDATED = {NO_TIMESTAMP, "Unable to parse timestamp", "Unable to retrieve EXIF data"}
+
+ProbeResult = namedtuple(
+    "ProbeResult", ["path", "timestamp", "reason", "source"], defaults=[None]
+)
+"""The outcome of probing one file.
+
+``path`` is the file path as a string, ``timestamp`` is a ``datetime`` of when
+the photo was taken, or None if it couldn't be determined, in which case
+``reason`` is a human-readable explanation of why the file should be skipped.
+``source`` is which of the ``SOURCES`` the timestamp came from.
+"""
+
+
+def probe_file(path: str | os.PathLike, reader: str = "header") -> ProbeResult:
+    """Find when the photo or video at the given path was taken.
+
+    The kind of file is told from its first bytes, rather than its name, and
+    files that aren't photos or videos are skipped straight away.
+
+    This never raises for a bad file, instead the failure is described by the
+    ``reason`` of the result so that it can be reported by whoever consumes the
+    result, which may be in a different thread.
+
+    Args:
+        path: The path to the photo
+        reader: How to read the metadata, one of ``READERS``
+
+    Returns:
+        The probe result for the file
+    """
+    path = os.fspath(path)
+
+    # The file is opened once, and its first bytes both tell which reader
+    # understands it, so other files don't have to be opened as images to find
+    # out they aren't any, and are handed to the EXIF reader so they aren't
+    # read again
+    try:
+        with open(path, mode="rb") as f:
+            size = exif.HEADER_SIZE if reader == "header" else sniff.SNIFF_SIZE
+            return _probe_open(path, f, f.read(size), reader)
+    except OSError:
+        return ProbeResult(path, None, UNREADABLE)
+    except Exception:
+        # A bug in a reader mustn't stop the rest of the files being sorted
+        logging.exception("Unexpected error probing %s", path)
+        return ProbeResult(path, None, "Unable to parse file")
+
+
+def _probe_open(path: str, f: BinaryIO, header: bytes, reader: str) -> ProbeResult:
+    kind = sniff.sniff(header[: sniff.SNIFF_SIZE])
+
+    if kind == "other":
+        return ProbeResult(path, None, NOT_MEDIA)
+    if kind in ("mp4", "mov"):
+        return _probe_video(path, f)
+
+    if reader == "pil" or kind in ("png", "gif", "webp"):
+        return _probe_with_pil(path, f)
+
+    try:
+        if kind == "heif":
+            dates = bmff.read_heif_dates(f)
+        elif kind == "cr3":
+            dates = bmff.read_cr3_dates(f)
+        elif reader == "mmap":
+            dates = exif.read_exif_dates_mmap(f)
+        else:
+            dates = exif.read_exif_dates(f, header)
+    except (exif.ExifError, bmff.BoxError):
+        # Not something the header reader understands, so let PIL try
+        return _probe_with_pil(path, f)
+
+    timestamp = dates.get(exif.DATETIME) or dates.get(exif.DATETIME_ORIGINAL)
+    return _parse_result(path, timestamp)
+
+
+def _probe_video(path: str, f: BinaryIO) -> ProbeResult:
+    try:
+        timestamp = bmff.read_video_timestamp(f)
+    except bmff.BoxError:
+        return ProbeResult(path, None, "Unable to parse video")
+
+    if not timestamp:
+        return ProbeResult(path, None, NO_TIMESTAMP)
+
+    return ProbeResult(path, timestamp, None, "container")
+
+
+def _probe_with_pil(path: str, f: BinaryIO) -> ProbeResult:
+    try:
+        f.seek(0)
+        image = Image.open(f)
+    except OSError:
+        return ProbeResult(path, None, "PIL failed to open image")
+
+    with image:
+        try:
+            exif_data = image.getexif()
+        except Exception:
+            return ProbeResult(path, None, "Unable to retrieve EXIF data")
+
+        # Exif.Image.DateTime, hex: 0x0132, dec: 306
+        timestamp = exif_data.get(ExifTags.Base.DateTime)
+
+        # Try something else if the timestamp doesn't exist
+        if not timestamp:
+            # Exif.Photo.DateTimeOriginal, hex: 0x9003, dec: 36867
+            timestamp = exif_data.get_ifd(ExifTags.IFD.Exif).get(
+                ExifTags.Base.DateTimeOriginal
+            )
+
+    return _parse_result(path, timestamp)
+
+
+def _parse_result(path: str, timestamp: str | None) -> ProbeResult:
+    if not timestamp:
+        return ProbeResult(path, None, NO_TIMESTAMP)
+
+    try:
+        dt = timestamps.parse_exif(timestamp)
+    except (ValueError, AttributeError):
+        return ProbeResult(path, None, "Unable to parse timestamp")
+
+    return ProbeResult(path, dt, None, "exif")
+
+
+def bounded_map(
+    executor: Executor, fn: Callable, items: Iterable, window: int
+) -> Iterator:
+    """Like ``executor.map``, but consumes ``items`` lazily.
+
+    At most ``window`` calls are submitted but not yet yielded at any time, and
+    results are yielded in the same order as ``items``.
+
+    Args:
+        executor: The executor to run ``fn`` on
+        fn: The function to call on each item
+        items: The arguments to ``fn``
+        window: The maximum number of outstanding calls
+    """
+    pending = deque()
+
+    for item in items:
+        pending.append(executor.submit(fn, item))
+
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    chunk = list()
+    for item in items:
+        chunk.append(item)
+
+        if len(chunk) >= size:
+            yield chunk
+            chunk = list()
+
+    if chunk:
+        yield chunk
+
+
+def _probe_item(item: str | ProbeResult, reader: str) -> ProbeResult:
+    # Files that were found in the cache don't need probing again
+    if isinstance(item, ProbeResult):
+        return item
+    return probe_file(item, reader)
+
+
+def _probe_chunk(items: list, reader: str) -> List[tuple]:
+    # Plain tuples are the cheapest thing to send back to the parent process
+    return [tuple(_probe_item(item, reader)) for item in items]
+
+
+def _chain(path: str, sources: Sequence[str]) -> Tuple[list, bool, list]:
+    # Splits the sources into the cheap ones to try before reading the file and
+    # those to try after, and tells whether the file is read at all
+    reading = "container" if path.lower().endswith(bmff.VIDEO_EXTENSIONS) else "exif"
+    if reading not in sources:
+        return [s for s in sources if s in _CHEAP_SOURCES], False, []
+
+    i = sources.index(reading)
+    before = [s for s in sources[:i] if s in _CHEAP_SOURCES]
+    after = [s for s in sources[i + 1 :] if s in _CHEAP_SOURCES]
+    return before, True, after
+
+
+def _try_cheap(path: str, source: str, pattern: re.Pattern) -> ProbeResult | None:
+    if source == "filename":
+        # Documents and the like can have dates in their names too
+        if not sniff.looks_like_media(path):
+            return None
+
+        try:
+            timestamp = timestamps.parse_filename(os.path.basename(path), pattern)
+        except ValueError:
+            return None
+    else:
+        try:
+            timestamp = datetime.fromtimestamp(os.stat(path).st_mtime)
+        except OSError:
+            return None
+
+    return ProbeResult(path, timestamp, None, source)
+
+
+def _check_cheap(
+    paths: Iterable[str | os.PathLike], sources: Sequence[str], pattern: re.Pattern
+) -> Iterator[str | os.PathLike | ProbeResult]:
+    for path in paths:
+        before, reads, _ = _chain(os.fspath(path), sources)
+
+        for source in before:
+            if result := _try_cheap(os.fspath(path), source, pattern):
+                yield result
+                break
+        else:
+            yield path if reads else ProbeResult(os.fspath(path), None, NO_TIMESTAMP)
+
+
+def _fall_back(
+    results: Iterable[ProbeResult], sources: Sequence[str], pattern: re.Pattern
+) -> Iterator[ProbeResult]:
+    for result in results:
+        if result.timestamp is None and result.reason in _UNDATED:
+            _, reads, after = _chain(result.path, sources)
+            for source in after if reads else ():
+                if dated := _try_cheap(result.path, source, pattern):
+                    result = dated
+                    break
+
+        yield result
+
+
+def _check_cache(
+    paths: Iterable[str | os.PathLike | ProbeResult],
+    cache,
+    stats: Dict[str, os.stat_result],
+) -> Iterator[str | ProbeResult]:
+    for path in paths:
+        if isinstance(path, ProbeResult):
+            yield path
+            continue
+
+        # Walker records may already know the status of the file
+        stat = getattr(path, "stat", None)
+        path = os.fspath(path)
+
+        if not isinstance(stat, os.stat_result):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                yield path
+                continue
+
+        if known := cache.get(path, stat):
+            yield known
+        else:
+            stats[path] = stat
+            yield path
+
+
+def probe_files(
+    paths: Iterable[str | os.PathLike],
+    workers: int | None = None,
+    mode: str = "thread",
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    reader: str = "header",
+    cache=None,
+    sources: Sequence[str] = DEFAULT_SOURCES,
+    filename_patterns: Iterable[str] | None = None,
+) -> Iterator[ProbeResult]:
+    """Probe many files concurrently.
+
+    Results are yielded in the same order as ``paths`` as soon as they are
+    available, so the caller can act on them while later files are still being
+    probed.
+
+    The ``sources`` are tried in order until one has a timestamp. Sources that
+    don't need the file to be read, like the file name, are tried before the
+    file is handed to a worker, so files dated by their names cost next to
+    nothing to probe.
+
+    Args:
+        paths: The files to probe
+        workers: The number of files to probe at once. If less than 2, files
+            are probed one at a time in the calling thread. Defaults to
+            ``DEFAULT_WORKERS`` in thread mode and the number of CPUs in
+            process mode.
+        mode: One of ``EXECUTION_MODES``
+        chunksize: The number of files sent to a worker process at once. Only
+            used in process mode.
+        reader: How to read the metadata, one of ``READERS``
+        cache: A ``cache.ProbeCache`` of earlier results. Files that haven't
+            changed since they were cached aren't probed again, and new
+            results are added to the cache. Only what was read from the files
+            is cached.
+        sources: Where to look for timestamps, in order. See ``SOURCES``.
+        filename_patterns: Regular expressions matching timestamps in file
+            names. Defaults to ``timestamps.FILENAME_PATTERNS``.
+
+    Raises:
+        ValueError: If the mode, reader or a source is unknown
+    """
+    if mode not in EXECUTION_MODES:
+        raise ValueError("Unknown execution mode", mode)
+    if reader not in READERS:
+        raise ValueError("Unknown metadata reader", reader)
+    for source in sources:
+        if source not in SOURCES:
+            raise ValueError("Unknown timestamp source", source)
+
+    sources = tuple(sources)
+    pattern = (
+        timestamps.compile_filename_patterns(filename_patterns)
+        if filename_patterns is not None
+        else None
+    )
+    items = _check_cheap(paths, sources, pattern)
+
+    if cache is None:
+        items = (
+            item if isinstance(item, ProbeResult) else os.fspath(item) for item in items
+        )
+        results = _probe_all(items, workers, mode, chunksize, reader)
+        yield from _fall_back(results, sources, pattern)
+        return
+
+    # The stats of files missing from the cache, so the results can be stored
+    # under the state of the file at the time it was probed
+    stats = dict()
+    items = _check_cache(items, cache, stats)
+
+    def cached(results):
+        for result in results:
+            if stat := stats.pop(result.path, None):
+                if result.reason != UNREADABLE:
+                    cache.put(result, stat)
+            yield result
+
+    results = _probe_all(items, workers, mode, chunksize, reader)
+    yield from _fall_back(cached(results), sources, pattern)
+
+
+def _probe_all(
+    items: Iterable, workers: int | None, mode: str, chunksize: int, reader: str
+) -> Iterator[ProbeResult]:
+    probe = partial(_probe_item, reader=reader)
+
+    if workers is None:
+        workers = DEFAULT_WORKERS if mode == "thread" else os.cpu_count() or 1
+
+    if workers < 2:
+        yield from map(probe, items)
+        return
+
+    window = workers * WINDOW_FACTOR
+
+    if mode == "thread":
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="probe"
+        ) as executor:
+            yield from bounded_map(executor, probe, items, window)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = _chunks(items, chunksize)
+            probe_chunk = partial(_probe_chunk, reader=reader)
+            for results in bounded_map(executor, probe_chunk, chunks, window):
+                yield from map(ProbeResult._make, results)
@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+from typing import Dict, List
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from . import main_log
+from .progress import Progress, format_size
+
+logging = main_log.getChild(__name__)
+
+PROFILE_NAME = "photo-sorter-profile"
+"""Name of the profile files, which are written next to the log"""
+
+TOP_FUNCTIONS = 40
+"""Number of functions listed in the summary of a profile"""
+
+# From Python 3.12, cProfile uses sys.monitoring, so a profiler sees every
+# thread and only one can be enabled at a time. Before that, each thread needs
+# a profiler of its own.
+_PER_THREAD = sys.version_info < (3, 12)
+
+AREAS = (
+    ("PIL", ("/PIL/",), ("PIL", "_imaging")),
+    ("HTTP", ("/requests/", "/urllib3/", "/http/", "ssl.py", "socket.py"), ("ssl",)),
+    ("probe cache", ("/sqlite3/",), ("sqlite3",)),
+    (
+        "file metadata",
+        (),
+        ("stat", "scandir", "DirEntry", "posix.access", "posix.listdir"),
+    ),
+    (
+        "moving files",
+        ("shutil.py",),
+        ("rename", "replace", "unlink", "link", "copy_file_range", "sendfile", "fsync"),
+    ),
+    ("reading files", (), ("read", "mmap", "io.open", "posix.open")),
+    ("waiting", (), ("acquire", "wait", "_queue", "sleep")),
+)
+"""Areas the time of a profile is split into. Each area lists words in the
+paths of the Python files and in the names of the built-in functions that
+belong to it. Functions are put in the first area matching them."""
+
+
+def _area(filename: str, function: str) -> str:
+    # Built-in functions have no file
+    builtin = filename == "~"
+    filename = filename.replace(os.sep, "/")
+
+    for area, files, builtins in AREAS:
+        if builtin:
+            if any(word in function for word in builtins):
+                return area
+        elif any(word in filename for word in files):
+            return area
+
+    return "other built-in functions" if builtin else "other Python code"
+
+
+def time_by_area(stats: pstats.Stats) -> Dict[str, float]:
+    """Split the time of a profile between the ``AREAS``, e.g. to tell whether
+    time goes to PIL, stat calls, moves or HTTP.
+
+    Each function's own time, excluding the functions it calls, counts towards
+    one area.
+
+    Args:
+        stats: The profile
+
+    Returns:
+        The seconds spent in each area, most first
+    """
+    areas = dict()
+    for (filename, _, function), (_, _, own_time, _, _) in stats.stats.items():
+        area = _area(filename, function)
+        areas[area] = areas.get(area, 0.0) + own_time
+
+    return dict(sorted(areas.items(), key=lambda item: item[1], reverse=True))
+
+
+@contextmanager
+def profiled(
+    progress: Progress | None = None,
+    directory: str | os.PathLike = ".",
+    name: str = PROFILE_NAME,
+):
+    """Profile the code run inside this context.
+
+    Everything run by the current thread, and by any threads started while
+    profiling, is profiled with cProfile. From Python 3.12, one profiler covers
+    every thread of the process. Worker processes aren't profiled. The
+    memory allocated by Python is traced with tracemalloc, which slows things
+    down, so don't compare the speed of profiled runs with unprofiled ones.
+
+    Two files are written once the context exits, even if it exits with an
+    error: ``name.pstats``, which can be explored with ``pstats`` or tools like
+    snakeviz, and ``name.txt``, a summary of where the time went.
+
+    Args:
+        progress: The progress of the run, whose stage timings are included in
+            the summary
+        directory: The folder the files are written to
+        name: The name of the files, without extensions
+    """
+    profilers: List[cProfile.Profile] = list()
+    lock = threading.Lock()
+
+    def profile_thread(*args):
+        # Replaces itself with a profiler for the thread on the first call made
+        # in each new thread
+        profiler = cProfile.Profile()
+        with lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    tracemalloc.start()
+    if _PER_THREAD:
+        threading.setprofile(profile_thread)
+    main_profiler = cProfile.Profile()
+
+    start = time.perf_counter()
+    main_profiler.enable()
+    try:
+        yield
+    finally:
+        main_profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        if _PER_THREAD:
+            threading.setprofile(None)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        with lock:
+            stats = pstats.Stats(main_profiler, *profilers)
+
+        stats_path = os.path.join(directory, f"{name}.pstats")
+        stats.dump_stats(stats_path)
+
+        summary_path = os.path.join(directory, f"{name}.txt")
+        with open(summary_path, mode="w", encoding="utf-8") as f:
+            threads = len(profilers) + 1 if _PER_THREAD else None
+            f.write(_summary(stats, elapsed, peak, threads, progress))
+
+        logging.info("Wrote profile to %s and %s", stats_path, summary_path)
+
+
+def _summary(
+    stats: pstats.Stats,
+    elapsed: float,
+    peak: int,
+    threads: int | None,
+    progress: Progress | None,
+) -> str:
+    out = io.StringIO()
+
+    out.write(f"Wall-clock time: {elapsed:.2f}s\n")
+    out.write(f"Peak memory allocated by Python: {format_size(peak)}\n")
+
+    if progress is not None:
+        out.write("\nTime the sorting loop spent in each stage:\n")
+        for stage, timing in progress.snapshot()["stages"].items():
+            out.write(
+                f"  {stage:<30} {timing['seconds']:>9.2f}s "
+                f"for {timing['count']} items\n"
+            )
+
+    if threads is None:
+        out.write("\nTime by area, summed over all threads:\n")
+    else:
+        out.write(f"\nTime by area, summed over {threads} profiled threads:\n")
+    for area, seconds in time_by_area(stats).items():
+        out.write(f"  {area:<30} {seconds:>9.2f}s\n")
+
+    out.write(f"\nTop {TOP_FUNCTIONS} functions by cumulative time:\n")
+    stats.stream = out
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+
+    return out.getvalue()
@@ -0,0 +1,274 @@
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Iterable, Iterator, List
+import time
+
+from . import main_log
+
+logging = main_log.getChild(__name__)
+
+REPORT_INTERVAL = 5.0
+"""Minimum seconds between status lines"""
+
+MAX_REASONS = 32
+"""Number of distinct skip reasons counted separately. Any further reasons are
+counted together, so that unusual reasons can't use up memory."""
+
+OTHER_REASONS = "other reasons"
+
+
+def format_size(size: float) -> str:
+    """Format a number of bytes for people, e.g. ``12.3 MB``."""
+    for unit in ("B", "kB", "MB", "GB", "TB"):
+        if size < 1000 or unit == "TB":
+            break
+        size /= 1000
+
+    return f"{size:.1f} {unit}" if unit != "B" else f"{size:.0f} B"
+
+
+class Progress:
+    """Tracks how sorting is going: how many files have been moved, skipped and
+    failed, how fast, and where the time goes.
+
+    Time is attributed to named stages, like ``"scan"``, ``"probe"`` and
+    ``"move"``. Stages may be nested, in which case time spent in the inner
+    stage isn't also counted for the outer one, so the stage times add up to
+    the time the sorting loop spent waiting on each stage. This shows which
+    stage to give more workers.
+
+    Every update takes constant time. A status line is logged at most every
+    ``interval`` seconds, and a summary is logged when the progress is used as
+    a context manager and exits.
+
+    Progress must only be updated from one thread.
+    """
+
+    def __init__(self, total: int | None = None, interval: float = REPORT_INTERVAL):
+        """Start tracking progress.
+
+        Args:
+            total: The number of files expected, to estimate when sorting will
+                finish. No estimate is made if None.
+            interval: The minimum seconds between status lines
+        """
+        self.total = total
+        self.interval = interval
+
+        self.files = 0
+        """The number of files dealt with, whatever happened to them"""
+
+        self.moved = 0
+        self.bytes = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.skipped = Counter()
+        """The number of files skipped, by reason"""
+
+        self.stage_seconds: Dict[str, float] = dict()
+        self.stage_counts: Dict[str, int] = dict()
+
+        # The stages currently being timed, innermost last
+        self._stages: List[str] = list()
+        self._stage_start = 0.0
+
+        self._start = time.monotonic()
+        self._last_report = self._start
+        self._last_files = 0
+        self._last_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.summary()
+
+    def _done(self):
+        self.files += 1
+
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self.report(now)
+
+    def add_moved(self, size: int | None = None):
+        """Count a file that was moved.
+
+        Args:
+            size: The size of the file in bytes, if known
+        """
+        self.moved += 1
+        self.bytes += size or 0
+        self._done()
+
+    def add_duplicate(self):
+        """Count a duplicate file that was deleted or linked."""
+        self.duplicates += 1
+        self._done()
+
+    def add_skipped(self, reason: str):
+        """Count a file that was left where it is.
+
+        Args:
+            reason: Why the file was skipped. Anything after a colon is taken
+                to be details, and ignored, so that reasons can be grouped.
+        """
+        reason = reason.split(":", 1)[0]
+        if reason not in self.skipped and len(self.skipped) >= MAX_REASONS:
+            reason = OTHER_REASONS
+
+        self.skipped[reason] += 1
+        self._done()
+
+    def add_failed(self):
+        """Count a file that couldn't be moved."""
+        self.failed += 1
+        self._done()
+
+    def _switch(self, now: float):
+        if self._stages:
+            stage = self._stages[-1]
+            self.stage_seconds[stage] = (
+                self.stage_seconds.get(stage, 0.0) + now - self._stage_start
+            )
+        self._stage_start = now
+
+    def start_stage(self, stage: str):
+        """Start timing a stage, pausing the timing of any stage it is inside.
+
+        Args:
+            stage: The name of the stage
+        """
+        self._switch(time.perf_counter())
+        self._stages.append(stage)
+
+    def end_stage(self):
+        """Stop timing the innermost stage, counting one more item for it, and
+        resume timing the stage it was inside."""
+        self._switch(time.perf_counter())
+        stage = self._stages.pop()
+        self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+
+    def stage(self, stage: str) -> "_Stage":
+        """Time a block of code as a stage.
+
+        Example::
+
+            with progress.stage("move"):
+                move_file(source, destination)
+        """
+        return _Stage(self, stage)
+
+    def timed(self, items: Iterable, stage: str) -> Iterator:
+        """Time how long it takes to get each item of an iterable as a stage.
+
+        Args:
+            items: The items, e.g. from a generator which does the work lazily
+            stage: The name of the stage
+        """
+        items = iter(items)
+        while True:
+            self.start_stage(stage)
+            try:
+                item = next(items)
+            except StopIteration:
+                # Finding out there is nothing left isn't an item
+                self._switch(time.perf_counter())
+                self._stages.pop()
+                return
+            except BaseException:
+                self.end_stage()
+                raise
+
+            self.end_stage()
+            yield item
+
+    def report(self, now: float | None = None):
+        """Log a status line with the recent throughput."""
+        now = now or time.monotonic()
+        elapsed = max(now - self._last_report, 1e-9)
+
+        rate = (self.files - self._last_files) / elapsed
+        byte_rate = (self.bytes - self._last_bytes) / elapsed
+
+        status = (
+            f"{self.files} files ({rate:.1f} files/s, {format_size(byte_rate)}/s): "
+            f"{self.moved} moved, {sum(self.skipped.values())} skipped, "
+            f"{self.failed} failed"
+        )
+
+        if self.total and self.files:
+            average = self.files / max(now - self._start, 1e-9)
+            remaining = max(self.total - self.files, 0) / average
+            status += f", ETA {timedelta(seconds=round(remaining))}"
+
+        logging.info(status)
+
+        self._last_report = now
+        self._last_files = self.files
+        self._last_bytes = self.bytes
+
+    def snapshot(self) -> dict:
+        """Get the counts and timings so far, e.g. to save them as JSON."""
+        elapsed = time.monotonic() - self._start
+
+        return {
+            "elapsed": elapsed,
+            "files": self.files,
+            "moved": self.moved,
+            "bytes": self.bytes,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "skipped": dict(self.skipped),
+            "files_per_second": self.files / elapsed if elapsed else 0.0,
+            "bytes_per_second": self.bytes / elapsed if elapsed else 0.0,
+            "stages": {
+                stage: {"seconds": seconds, "count": self.stage_counts.get(stage, 0)}
+                for stage, seconds in self.stage_seconds.items()
+            },
+        }
+
+    def summary(self):
+        """Log the totals, average throughput and time spent in each stage."""
+        stats = self.snapshot()
+
+        logging.info(
+            "Dealt with %s files in %s: %s moved (%s), %s duplicates removed, "
+            "%s skipped, %s failed",
+            self.files,
+            timedelta(seconds=round(stats["elapsed"])),
+            self.moved,
+            format_size(self.bytes),
+            self.duplicates,
+            sum(self.skipped.values()),
+            self.failed,
+        )
+        logging.info(
+            "Average %.1f files/s, %s/s",
+            stats["files_per_second"],
+            format_size(stats["bytes_per_second"]),
+        )
+
+        for stage, timing in stats["stages"].items():
+            per_item = timing["seconds"] / max(timing["count"], 1) * 1000
+            logging.info(
+                "Time in %s: %.2fs, %.2f ms each for %s",
+                stage,
+                timing["seconds"],
+                per_item,
+                timing["count"],
+            )
+
+        for reason, count in self.skipped.most_common():
+            logging.info("Skipped %s: %s", count, reason)
+
+
+class _Stage:
+    def __init__(self, progress: Progress, stage: str):
+        self._progress = progress
+        self._stage = stage
+
+    def __enter__(self):
+        self._progress.start_stage(self._stage)
+
+    def __exit__(self, *args):
+        self._progress.end_stage()
@@ -0,0 +1,111 @@
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List
+import itertools
+import os
+
+from . import main_log
+from .bmff import VIDEO_EXTENSIONS
+from .walker import FileRecord
+
+logging = main_log.getChild(__name__)
+
+SIDECAR_EXTENSIONS = (".xmp", ".aae", ".thm")
+"""Extensions of files that only describe another file: XMP metadata from
+editors like Lightroom and darktable, edits made in Apple Photos and the
+thumbnails cameras write next to videos."""
+
+FileGroup = namedtuple("FileGroup", ["primary", "companions"])
+"""A file to sort together with the files belonging to it.
+
+``primary`` is the record of the file whose date decides where the group goes,
+and ``companions`` are the records of its sidecars and, for a photo, the video
+of a Live Photo. ``companions`` is empty for files on their own.
+"""
+
+
+def _kind(name: str) -> int:
+    # Photos come first, then videos, then sidecars
+    name = name.lower()
+    if name.endswith(SIDECAR_EXTENSIONS):
+        return 2
+    if name.endswith(VIDEO_EXTENSIONS):
+        return 1
+    return 0
+
+
+def stem(name: str) -> str:
+    """Get the part of a file name shared by a photo and its companions.
+
+    This is the name without its extension, compared case-insensitively. XMP
+    sidecars named after the whole file name, like ``IMG_0001.HEIC.xmp``, lose
+    both extensions.
+
+    Args:
+        name: The file name
+    """
+    base, ext = os.path.splitext(name.lower())
+    if ext == ".xmp" and os.path.splitext(base)[1]:
+        base = os.path.splitext(base)[0]
+
+    return base
+
+
+def companion_name(name: str, primary: str, renamed: str) -> str:
+    """Name a companion after its primary file was renamed, so that the two
+    still belong together, e.g. ``IMG_0001 (1).AAE`` for ``IMG_0001 (1).HEIC``.
+
+    Args:
+        name: The name of the companion
+        primary: The original name of the primary file
+        renamed: The new name of the primary file
+    """
+    if primary == renamed:
+        return name
+
+    old, new = os.path.splitext(primary)[0], os.path.splitext(renamed)[0]
+    return new + name[len(old) :]
+
+
+def _group(records: Iterable[FileRecord]) -> Iterator[FileGroup]:
+    stems: Dict[str, List[FileRecord]] = dict()
+    for record in records:
+        stems.setdefault(stem(record.name), list()).append(record)
+
+    for members in stems.values():
+        primary = min(members, key=lambda member: _kind(member.name))
+        kind = _kind(primary.name)
+
+        companions = [m for m in members if _kind(m.name) > kind]
+        yield FileGroup(primary, companions)
+
+        # Files of the same kind, such as raw and JPEG pairs, are dated on
+        # their own
+        for other in members:
+            if other is not primary and _kind(other.name) == kind:
+                yield FileGroup(other, [])
+
+
+def group_files(records: Iterable[FileRecord]) -> Iterator[FileGroup]:
+    """Group files with their sidecars and Live Photo videos.
+
+    Photos are grouped with the videos and sidecars that share their name, and
+    videos with the sidecars that share theirs, so that the whole group can be
+    dated from the photo or video and sorted into the same folder. Only files
+    in the same directory are grouped.
+
+    The records are indexed by name one directory at a time, as ``walker.walk``
+    yields them, so this works on trees of any size. Records in any other order
+    are still grouped, but only with the files next to them in the same
+    directory.
+
+    Args:
+        records: The files, e.g. from ``walker.walk``
+
+    Yields:
+        The groups, in the order their first file was found
+    """
+    by_directory = itertools.groupby(
+        records, key=lambda record: os.path.dirname(record.path)
+    )
+    for _, files in by_directory:
+        yield from _group(files)
@@ -0,0 +1,136 @@
+from typing import Dict, Tuple
+import os
+
+from . import main_log
+from . import bmff
+from . import exif
+
+logging = main_log.getChild(__name__)
+
+SNIFF_SIZE = 32
+"""Number of bytes read from the start of a file to tell what kind it is"""
+
+KINDS = ("jpeg", "png", "gif", "webp", "heif", "tiff", "raw", "cr3", "mp4", "mov")
+"""The kinds of photos and videos files are sorted into. Anything else is
+``other``, and isn't a photo or video that can be sorted."""
+
+SIGNATURES: Tuple[Tuple[int, bytes, str], ...] = (
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (8, b"WEBP", "webp"),
+    # Canon's CR2 is a TIFF marked as a raw file
+    (8, b"CR\x02", "raw"),
+    *((0, signature, "tiff") for signature in exif.TIFF_SIGNATURES[:2]),
+    *((0, signature, "raw") for signature in exif.TIFF_SIGNATURES[2:]),
+    (0, b"FUJIFILMCCD-RAW", "raw"),
+    (6, b"HEAPCCDR", "raw"),
+)
+"""The offsets and bytes at the start of each kind of file, checked in order.
+ISO base media files (HEIF, CR3, MP4 and QuickTime) are told apart by their
+boxes instead."""
+
+HEIF_BRANDS = {
+    b"heic",
+    b"heix",
+    b"heim",
+    b"heis",
+    b"hevc",
+    b"hevx",
+    b"hevm",
+    b"hevs",
+    b"mif1",
+    b"msf1",
+    b"avif",
+    b"avis",
+}
+"""Major brands of HEIF and AVIF images"""
+
+# Boxes QuickTime files without a file type box can start with
+_QUICKTIME_BOXES = {b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+
+EXTENSIONS: Dict[str, Tuple[str, ...]] = {
+    "jpeg": (".jpg", ".jpeg", ".jpe", ".jfif"),
+    "png": (".png",),
+    "gif": (".gif",),
+    "webp": (".webp",),
+    "heif": bmff.HEIF_EXTENSIONS,
+    "tiff": (".tif", ".tiff", ".dng"),
+    "raw": (
+        ".cr2",
+        ".crw",
+        ".nef",
+        ".nrw",
+        ".arw",
+        ".srf",
+        ".sr2",
+        ".orf",
+        ".rw2",
+        ".raf",
+        ".pef",
+        ".srw",
+    ),
+    "cr3": bmff.CR3_EXTENSIONS,
+    "mp4": (".mp4", ".m4v", ".3gp", ".3g2"),
+    "mov": (".mov", ".qt"),
+}
+"""The usual extensions of each kind of file"""
+
+MEDIA_EXTENSIONS = tuple(ext for exts in EXTENSIONS.values() for ext in exts)
+"""Extensions of all the photos and videos that can be sorted"""
+
+
+def sniff(header: bytes) -> str:
+    """Tell what kind of file something is from its first bytes.
+
+    Args:
+        header: At least the first ``SNIFF_SIZE`` bytes of the file, if it has
+            that many
+
+    Returns:
+        One of ``KINDS``, or ``"other"``
+    """
+    for offset, signature, kind in SIGNATURES:
+        if header[offset : offset + len(signature)] == signature:
+            return kind
+
+    box = header[4:8]
+    if box == b"ftyp":
+        brand = header[8:12]
+        if brand in HEIF_BRANDS:
+            return "heif"
+        if brand == b"crx ":
+            return "cr3"
+        return "mov" if brand == b"qt  " else "mp4"
+
+    if box in _QUICKTIME_BOXES:
+        return "mov"
+
+    return "other"
+
+
+def sniff_file(path: str | os.PathLike) -> str:
+    """Tell what kind of file something is from its first bytes.
+
+    Args:
+        path: The file
+
+    Returns:
+        One of ``KINDS``, or ``"other"``
+
+    Raises:
+        OSError: If the file can't be read
+    """
+    with open(path, mode="rb") as f:
+        return sniff(f.read(SNIFF_SIZE))
+
+
+def looks_like_media(name: str) -> bool:
+    """Tell whether a file is named like a photo or video, without looking at
+    it.
+
+    Args:
+        name: The file name
+    """
+    return name.lower().endswith(MEDIA_EXTENSIONS)
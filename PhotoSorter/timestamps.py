@@ -0,0 +1,198 @@
+from dateutil import parser
+from datetime import datetime, timezone
+from typing import Iterable
+import re
+
+FIXED_LENGTH = 19
+"""Length of a timestamp like ``2019:07:04 15:30:00`` or
+``2019-07-04T15:30:00``, which the fast parsers handle"""
+
+_YEAR = r"(?P<year>(?:19|20)\d\d)"
+_MONTH = r"(?P<month>0[1-9]|1[0-2])"
+_DAY = r"(?P<day>0[1-9]|[12]\d|3[01])"
+_HOUR = r"(?P<hour>[01]\d|2[0-3])"
+_MINUTE = r"(?P<minute>[0-5]\d)"
+_SECOND = r"(?P<second>[0-5]\d)"
+
+FILENAME_PATTERNS = (
+    # IMG_20190704_153000.jpg, PXL_20230101_123456789.jpg, 20190704_153000.mp4
+    rf"(?<!\d){_YEAR}{_MONTH}{_DAY}[_-]{_HOUR}{_MINUTE}{_SECOND}",
+    # Screenshot_2021-05-03-14-22-10.png, Screenshot 2021-05-03 at 14.22.10.png
+    rf"(?<!\d){_YEAR}-{_MONTH}-{_DAY}(?:[ _-]| at ){_HOUR}[.-]{_MINUTE}[.-]{_SECOND}",
+    # IMG-20200101-WA0001.jpg, VID-20200101-WA0001.mp4 from WhatsApp
+    rf"-{_YEAR}{_MONTH}{_DAY}-WA\d",
+)
+"""Regular expressions matching the timestamps in the names cameras, phones and
+apps give files. Each captures at least ``year``, ``month`` and ``day``, and
+may capture ``hour``, ``minute`` and ``second``."""
+
+
+def _fields(value: str) -> datetime:
+    # Works for both EXIF and ISO 8601 timestamps, since their digits are in the
+    # same places. The separators are checked by the callers.
+    if not (value[:4].isdigit() and value[5:7].isdigit() and value[8:10].isdigit()):
+        raise ValueError("Not a timestamp", value)
+    if not (value[11:13].isdigit() and value[14:16].isdigit()):
+        raise ValueError("Not a timestamp", value)
+    if not value[17:19].isdigit():
+        raise ValueError("Not a timestamp", value)
+
+    return datetime(
+        int(value[0:4]),
+        int(value[5:7]),
+        int(value[8:10]),
+        int(value[11:13]),
+        int(value[14:16]),
+        int(value[17:19]),
+    )
+
+
+def _fallback(value: str) -> datetime:
+    try:
+        return parser.parse(value)
+    except OverflowError:
+        raise ValueError("Timestamp out of range", value)
+
+
+def parse_exif(value: str) -> datetime:
+    """Parse an EXIF timestamp, like ``2019:07:04 15:30:00``.
+
+    Timestamps in exactly that format are parsed by slicing. Anything else,
+    e.g. with fractional seconds or a time zone, is left to dateutil.
+
+    Args:
+        value: The timestamp. Surrounding spaces and NULs are ignored.
+
+    Returns:
+        The timestamp, without a time zone
+
+    Raises:
+        ValueError: If the value isn't a valid timestamp, e.g. the
+            ``0000:00:00 00:00:00`` written by cameras whose clock wasn't set
+    """
+    value = value.strip("\x00 ")
+
+    if (
+        len(value) == FIXED_LENGTH
+        and value[4] == value[7] == value[13] == value[16] == ":"
+        and value[10] == " "
+    ):
+        try:
+            return _fields(value)
+        except ValueError:
+            # Invalid dates are still invalid for dateutil
+            raise ValueError("Invalid timestamp", value)
+
+    # dateutil doesn't understand colons between the parts of the date
+    return _fallback(value.replace(":", "-", 2))
+
+
+def parse_iso(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp, like the ``2019-07-04T15:30:00Z`` used by
+    Microsoft Graph.
+
+    Timestamps in exactly that format, with or without the ``Z``, are parsed
+    by slicing. Other ISO 8601 timestamps are parsed with
+    ``datetime.fromisoformat``, and anything else is left to dateutil.
+
+    Args:
+        value: The timestamp
+
+    Returns:
+        The timestamp, in UTC if it ended with ``Z``
+
+    Raises:
+        ValueError: If the value isn't a valid timestamp
+    """
+    value = value.strip()
+
+    if (
+        FIXED_LENGTH <= len(value) <= FIXED_LENGTH + 1
+        and value[4] == value[7] == "-"
+        and value[13] == value[16] == ":"
+        and value[10] in "T "
+    ):
+        if len(value) == FIXED_LENGTH:
+            return _fields(value)
+        if value[-1] == "Z":
+            return _fields(value).replace(tzinfo=timezone.utc)
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return _fallback(value)
+
+
+def parse(value: str) -> datetime:
+    """Parse an EXIF or ISO 8601 timestamp.
+
+    Args:
+        value: The timestamp
+
+    Raises:
+        ValueError: If the value isn't a valid timestamp
+    """
+    if value.strip("\x00 ")[4:5] == ":":
+        return parse_exif(value)
+    return parse_iso(value)
+
+
+def compile_filename_patterns(patterns: Iterable[str]) -> re.Pattern:
+    """Combine patterns like ``FILENAME_PATTERNS`` into one regular expression,
+    so a file name is searched for all of them in one pass.
+
+    Args:
+        patterns: The regular expressions, using the group names of
+            ``FILENAME_PATTERNS``
+
+    Raises:
+        re.error: If a pattern is invalid
+    """
+    alternatives = list()
+    for i, pattern in enumerate(patterns):
+        # Group names must be unique across the whole expression
+        pattern = re.sub(r"\(\?P<(\w+)>", rf"(?P<\1_{i}>", pattern)
+        alternatives.append(f"(?P<pattern_{i}>{pattern})")
+
+    return re.compile("|".join(alternatives), re.IGNORECASE)
+
+
+_FILENAME_PATTERN = compile_filename_patterns(FILENAME_PATTERNS)
+
+
+def parse_filename(name: str, pattern: re.Pattern | None = None) -> datetime:
+    """Find the timestamp in a file name, like ``IMG_20190704_153000.jpg``.
+
+    Args:
+        name: The file name
+        pattern: The patterns to look for, from ``compile_filename_patterns``.
+            Defaults to ``FILENAME_PATTERNS``.
+
+    Returns:
+        The timestamp, at midnight if the name only has a date
+
+    Raises:
+        ValueError: If the name has no valid timestamp
+    """
+    match = (pattern or _FILENAME_PATTERN).search(name)
+    if not match:
+        raise ValueError("No timestamp in file name", name)
+
+    # The group around the whole pattern that matched closes last
+    i = match.lastgroup.rpartition("_")[2]
+    fields = match.groupdict()
+
+    def field(key):
+        return int(fields.get(f"{key}_{i}") or 0)
+
+    try:
+        return datetime(
+            field("year"),
+            field("month"),
+            field("day"),
+            field("hour"),
+            field("minute"),
+            field("second"),
+        )
+    except ValueError:
+        raise ValueError("Invalid timestamp in file name", name)
@@ -0,0 +1,338 @@
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator
+import errno
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import main_log
+
+logging = main_log.getChild(__name__)
+
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+"""Number of bytes copied per system call when copying between devices"""
+
+BUFFER_SIZE = 8 * 1024 * 1024
+"""Size of the buffer used when the kernel can't copy files by itself"""
+
+DEFAULT_COPY_WORKERS = 4
+"""Default number of files copied at once between devices"""
+
+OUTPUT_MODES = ("move", "copy", "hardlink", "reflink", "symlink", "link")
+"""Ways of putting files into the sorted tree.
+
+``move`` moves the files. The other modes leave the files where they are and
+build a sorted view of them instead: ``copy`` copies them, ``hardlink`` makes
+hard links to them, which only works on the same file system, ``reflink``
+clones them, so the copy shares its data with the original until either is
+changed, which only works on file systems like Btrfs and XFS, and ``symlink``
+makes symbolic links to them. ``link`` uses the first of hard links, reflinks
+and symbolic links that works, and only copies files when none of them do.
+"""
+
+LINK_METHODS = ("hardlink", "reflink", "symlink", "copy")
+"""The methods tried, in order, in the ``link`` output mode"""
+
+_FICLONE = 0x40049409
+"""Linux ioctl that makes a file share the data of another file"""
+
+# Errors meaning the kernel can't do an in-kernel copy between the two files,
+# in which case a slower method has to be used instead
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+# Errors meaning a way of linking files doesn't work between the two places, in
+# which case the next way is tried in the link output mode
+_UNLINKABLE = _UNSUPPORTED | {errno.EPERM, errno.EMLINK, errno.ENOTTY}
+
+Transfer = namedtuple("Transfer", ["source", "destination", "error"])
+"""A finished move. ``error`` is the exception that caused the move to fail, or
+None if it succeeded."""
+
+
+def _copy_data(src: int, dst: int):
+    copied = 0
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while n := os.copy_file_range(src, dst, COPY_CHUNK_SIZE):
+                copied += n
+            return
+        except OSError as err:
+            if copied or err.errno not in _UNSUPPORTED:
+                raise
+
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        try:
+            while n := os.sendfile(dst, src, copied, COPY_CHUNK_SIZE):
+                copied += n
+            return
+        except OSError as err:
+            if copied or err.errno not in _UNSUPPORTED:
+                raise
+
+    buf = bytearray(BUFFER_SIZE)
+    view = memoryview(buf)
+    with open(src, mode="rb", buffering=0, closefd=False) as f:
+        while n := f.readinto(buf):
+            os.write(dst, view[:n])
+
+
+def copy_file(
+    source: str | os.PathLike, destination: str | os.PathLike, clone: bool = False
+):
+    """Copy a file so that the destination either doesn't exist or is a
+    complete copy, even if the copy is interrupted.
+
+    The data is written to a temporary file next to the destination, flushed to
+    disk, and then renamed into place. The kernel copies the data directly
+    where possible.
+
+    Args:
+        source: The file to copy
+        destination: The path of the copy
+        clone: Whether to make a reflink, sharing the data of the source rather
+            than copying it
+
+    Raises:
+        OSError: If ``clone`` is True and the file system can't clone the file
+    """
+    if clone and fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported", source)
+
+    directory, name = os.path.split(os.fspath(destination))
+    fd, temp = tempfile.mkstemp(prefix=f".{name}.", suffix=".partial", dir=directory)
+
+    try:
+        with os.fdopen(fd, mode="wb") as dst, open(source, mode="rb") as src:
+            if clone:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            else:
+                _copy_data(src.fileno(), dst.fileno())
+            os.fsync(dst.fileno())
+
+        shutil.copystat(source, temp)
+        os.replace(temp, destination)
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+
+def move_file(
+    source: str | os.PathLike, destination: str | os.PathLike, rename: bool = True
+):
+    """Move a file, renaming it if possible and copying it otherwise.
+
+    Args:
+        source: The file to move
+        destination: The new path of the file
+        rename: Whether to try renaming the file first. Pass False if the
+            source and destination are known to be on different devices.
+    """
+    if rename:
+        try:
+            os.rename(source, destination)
+            return
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+
+    copy_file(source, destination)
+    os.unlink(source)
+
+
+def link_file(source: str | os.PathLike, destination: str | os.PathLike, method: str):
+    """Put a file into the sorted tree without moving it.
+
+    Args:
+        source: The file
+        destination: The path in the sorted tree
+        method: One of ``LINK_METHODS``
+
+    Raises:
+        OSError: If the method doesn't work for the file
+    """
+    if method == "hardlink":
+        os.link(source, destination)
+    elif method == "reflink":
+        copy_file(source, destination, clone=True)
+    elif method == "symlink":
+        # Absolute, so the link works wherever the sorted tree is
+        os.symlink(os.path.abspath(source), destination)
+    elif method == "copy":
+        copy_file(source, destination)
+    else:
+        raise ValueError("Unknown link method", method)
+
+
+class Mover:
+    """Moves files into a destination tree, renaming them when they are on the
+    same device and copying them in parallel when they aren't.
+
+    Whether a file can be renamed is decided once per source directory, up
+    front. Renames happen immediately, while copies run in the background.
+    Either way, the outcome of each move is reported by ``finished``, which
+    should be called regularly.
+
+    In the other ``OUTPUT_MODES``, files are linked or copied instead, and the
+    originals are kept. Links are made immediately. In the ``link`` mode, the
+    way of linking that worked last is remembered for each source directory.
+    """
+
+    def __init__(
+        self,
+        out: str | os.PathLike,
+        workers: int = DEFAULT_COPY_WORKERS,
+        output: str = "move",
+    ):
+        """Prepare to move files.
+
+        Args:
+            out: The directory files are being moved to
+            workers: The number of files to copy at once between devices
+            output: One of ``OUTPUT_MODES``
+
+        Raises:
+            ValueError: If ``output`` isn't one of ``OUTPUT_MODES``
+        """
+        if output not in OUTPUT_MODES:
+            raise ValueError("Unknown output mode", output)
+
+        self.device = os.stat(out).st_dev
+        self.workers = workers
+        self.output = output
+        self.keeps_sources = output != "move"
+
+        # The ways of linking files still worth trying, for each source
+        # directory
+        self._methods = LINK_METHODS if output == "link" else (output,)
+        self._link_methods: Dict[str, tuple] = dict()
+
+        self._executor = None
+        self._pending = deque()
+
+        # Whether files in each source directory are on the same device as the
+        # destination
+        self._renameable: Dict[str, bool] = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _can_rename(self, source: str | os.PathLike) -> bool:
+        directory = os.path.dirname(os.fspath(source))
+
+        if (renameable := self._renameable.get(directory)) is None:
+            try:
+                renameable = os.stat(directory or ".").st_dev == self.device
+            except OSError:
+                # Let the move itself report the problem
+                renameable = True
+
+            if not renameable:
+                logging.info("%s is on a different device, copying", directory)
+            self._renameable[directory] = renameable
+
+        return renameable
+
+    def move(self, source: str | os.PathLike, destination: str | os.PathLike):
+        """Move a file, or link or copy it in the other output modes.
+
+        If too many copies are already in progress, this waits for the oldest
+        one to finish.
+
+        Args:
+            source: The file to move
+            destination: The new path of the file
+        """
+        if self.keeps_sources:
+            future = self._link(source, destination)
+        elif self._can_rename(source):
+            future = Future()
+            try:
+                move_file(source, destination)
+                future.set_result(None)
+            except Exception as err:
+                future.set_exception(err)
+        else:
+            future = self._submit(move_file, source, destination, False)
+
+        self._pending.append((source, destination, future))
+
+    def _submit(self, function, *args) -> Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="copy"
+            )
+
+        # Wait for the oldest copy so copies don't pile up in memory
+        if len(self._pending) >= self.workers * 2:
+            self._pending[0][2].exception()
+
+        return self._executor.submit(function, *args)
+
+    def _link(
+        self, source: str | os.PathLike, destination: str | os.PathLike
+    ) -> Future:
+        directory = os.path.dirname(os.fspath(source))
+        methods = self._link_methods.get(directory, self._methods)
+
+        future = Future()
+        for i, method in enumerate(methods):
+            if method == "copy":
+                return self._submit(copy_file, source, destination)
+
+            try:
+                link_file(source, destination, method)
+                future.set_result(None)
+                return future
+            except OSError as err:
+                if i + 1 == len(methods) or err.errno not in _UNLINKABLE:
+                    future.set_exception(err)
+                    return future
+
+                logging.info(
+                    "Can't %s files from %s (%s), trying %s instead",
+                    method,
+                    directory,
+                    err,
+                    methods[i + 1],
+                )
+                self._link_methods[directory] = methods[i + 1 :]
+            except Exception as err:
+                future.set_exception(err)
+                return future
+
+        return future
+
+    def finished(self, wait: bool = False) -> Iterator[Transfer]:
+        """Get the moves that have finished since this was last called, in the
+        order the moves were started.
+
+        Args:
+            wait: Whether to wait for all moves to finish
+        """
+        while self._pending:
+            source, destination, future = self._pending[0]
+            if not wait and not future.done():
+                break
+
+            self._pending.popleft()
+            yield Transfer(source, destination, future.exception())
+
+    def close(self):
+        """Wait for all moves to finish. Their outcomes can still be retrieved
+        with ``finished``."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
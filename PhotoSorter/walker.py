@@ -0,0 +1,179 @@
+from collections import namedtuple
+from stat import S_ISREG
+from typing import Iterable, Iterator
+import fnmatch
+import os
+import re
+
+from . import main_log
+
+logging = main_log.getChild(__name__)
+
+
+class FileRecord(namedtuple("FileRecord", ["path", "name", "stat"])):
+    """A file found while walking a directory tree.
+
+    ``path`` is the path to the file as a string, ``name`` is the file name
+    and ``stat`` is the ``os.stat_result`` of the file, if it was asked for.
+    Records can be used anywhere a path can.
+    """
+
+    __slots__ = ()
+
+    def __fspath__(self) -> str:
+        return self.path
+
+
+def compile_patterns(patterns: Iterable[str] | None) -> re.Pattern | None:
+    """Combine shell-style patterns into one case-insensitive regular
+    expression, so a name can be tested against all of them in one go.
+
+    Args:
+        patterns: The patterns, as understood by ``fnmatch``
+
+    Returns:
+        The compiled expression, or None if there are no patterns
+    """
+    if not patterns:
+        return None
+
+    return re.compile(
+        "|".join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE
+    )
+
+
+def walk(
+    root: str | os.PathLike,
+    recursive: bool = True,
+    include: Iterable[str] | None = None,
+    exclude: Iterable[str] | None = None,
+    prune: Iterable[str | os.PathLike] = (),
+    stat: bool = False,
+) -> Iterator[FileRecord]:
+    """Find the files in a directory tree.
+
+    Files are yielded as they are found, so this works on trees of any size.
+    The file type reported by the directory listing is used, so no file needs
+    to be stat-ed unless ``stat`` is True, and even then the information is
+    reused where the platform already provided it.
+
+    Args:
+        root: The directory to walk
+        recursive: Whether to walk into subdirectories
+        include: Shell-style patterns of the file names to yield. All files are
+            yielded if None.
+        exclude: Shell-style patterns of file and directory names to ignore
+        prune: Directories not to walk into, e.g. because the sorted files are
+            being written there
+        stat: Whether to include the status of each file in the records
+
+    Raises:
+        OSError: If ``root`` can't be listed
+    """
+    include = compile_patterns(include)
+    exclude = compile_patterns(exclude)
+
+    pruned = set()
+    for path in prune:
+        try:
+            st = os.stat(path)
+            pruned.add((st.st_dev, st.st_ino))
+        except OSError:
+            pass
+
+    pending = [os.fspath(root)]
+    while pending:
+        directory = pending.pop()
+
+        try:
+            entries = os.scandir(directory)
+        except OSError as err:
+            if directory == os.fspath(root):
+                raise
+
+            logging.warning("Skipping directory %s: %s", directory, err)
+            continue
+
+        subdirectories = list()
+        with entries:
+            for entry in entries:
+                if exclude and exclude.match(entry.name):
+                    continue
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            subdirectories.append(entry)
+                        continue
+
+                    if not entry.is_file():
+                        logging.info("Skipping %s: not a file", entry.name)
+                        continue
+
+                    if include and not include.match(entry.name):
+                        continue
+
+                    yield FileRecord(
+                        entry.path, entry.name, entry.stat() if stat else None
+                    )
+                except OSError as err:
+                    logging.warning("Skipping %s: %s", entry.name, err)
+
+        # Directories are walked in the order they were listed
+        for entry in reversed(subdirectories):
+            if pruned:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError as err:
+                    logging.warning("Skipping directory %s: %s", entry.path, err)
+                    continue
+
+                if (st.st_dev, st.st_ino) in pruned:
+                    continue
+
+            pending.append(entry.path)
+
+
+def records(
+    paths: Iterable[str | os.PathLike],
+    include: Iterable[str] | None = None,
+    exclude: Iterable[str] | None = None,
+    stat: bool = False,
+) -> Iterator[FileRecord]:
+    """Make records of particular files, like those ``walk`` finds.
+
+    Paths that aren't files, or that no longer exist, are left out, as are
+    files whose names don't match the patterns.
+
+    Args:
+        paths: The files
+        include: Shell-style patterns of the file names to yield. All files are
+            yielded if None.
+        exclude: Shell-style patterns of file names to ignore
+        stat: Whether to include the status of each file in the records
+    """
+    include = compile_patterns(include)
+    exclude = compile_patterns(exclude)
+
+    for path in paths:
+        path = os.fspath(path)
+        name = os.path.basename(path)
+
+        if exclude and exclude.match(name):
+            continue
+        if include and not include.match(name):
+            continue
+
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            logging.debug("Skipping %s: no longer exists", name)
+            continue
+        except OSError as err:
+            logging.warning("Skipping %s: %s", name, err)
+            continue
+
+        if not S_ISREG(st.st_mode):
+            continue
+
+        yield FileRecord(path, name, st if stat else None)
@@ -0,0 +1,499 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from . import disk_sorter
+from . import main_log
+from . import transfer
+from . import walker
+from .dedup import Deduplicator
+from .destination import DestinationIndex
+from .progress import Progress
+
+logging = main_log.getChild(__name__)
+
+DEBOUNCE = 2.0
+"""Seconds a new file must stay the same size before it is sorted, so that
+files still being written aren't moved"""
+
+POLL_INTERVAL = 5.0
+"""Seconds between checks for changed directories when inotify isn't
+available"""
+
+WAKE_INTERVAL = 1.0
+"""Longest time spent waiting for changes before checking whether to stop"""
+
+PRUNE_INTERVAL = 600.0
+"""Seconds between clearing out what is remembered about files that have since
+been removed, so that watching for a long time doesn't use ever more memory"""
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Finds the files that appear in a directory tree, using Linux's inotify
+    to be told about them rather than looking for them.
+
+    Each directory in the tree is watched, including directories created
+    later.
+    """
+
+    def __init__(
+        self,
+        root: str | os.PathLike,
+        recursive: bool = True,
+        exclude: Iterable[str] | None = None,
+        prune: Iterable[str | os.PathLike] = (),
+    ):
+        """Start watching a directory tree.
+
+        Args:
+            root: The top of the tree
+            recursive: Whether to watch subdirectories too
+            exclude: Shell-style patterns of directory names not to watch
+            prune: Directories not to watch
+
+        Raises:
+            OSError: If inotify isn't available, e.g. on other systems than
+                Linux, or the tree can't be watched
+        """
+        self.root = os.fspath(root)
+        self.recursive = recursive
+        self._exclude = walker.compile_patterns(exclude)
+        self._pruned = _identities(prune)
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            raise OSError("inotify isn't available")
+
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "Unable to start inotify")
+        self._fd = fd
+
+        # The directory of each watch, by watch descriptor
+        self._directories: Dict[int, str] = dict()
+
+        self._watch(self.root, required=True)
+
+    def _watch(self, top: str, required: bool = False) -> List[str]:
+        # Watches a directory and the directories in it, returning the files
+        # already in them
+        files = list()
+
+        for directory in _directories(top, self.recursive, self._exclude, self._pruned):
+            wd = self._add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+            if wd < 0:
+                err = OSError(ctypes.get_errno(), "Unable to watch directory")
+                if required and directory == top:
+                    raise err
+                logging.warning("Not watching %s: %s", directory, err)
+                continue
+
+            self._directories[wd] = directory
+            files.extend(_files(directory))
+
+        return files
+
+    def changes(self, timeout: float | None) -> Set[str]:
+        """Wait for files to appear or change.
+
+        Args:
+            timeout: The longest time to wait, in seconds. Waits for changes
+                however long it takes if None.
+
+        Returns:
+            The paths of the files that were created, finished being written
+            or moved into the tree, if any
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+                pos += length
+
+                if mask & _IN_Q_OVERFLOW:
+                    # Too much happened at once, so look at everything
+                    logging.warning("Missed changes in %s, rescanning", self.root)
+                    changed.update(_all_files(self._directories.values()))
+                    continue
+
+                if mask & _IN_IGNORED:
+                    # The directory was deleted or moved away
+                    self._directories.pop(wd, None)
+                    continue
+
+                directory = self._directories.get(wd)
+                if directory is None:
+                    continue
+
+                path = os.path.join(directory, name)
+                if mask & _IN_ISDIR:
+                    if self.recursive and mask & (_IN_CREATE | _IN_MOVED_TO):
+                        changed.update(self._watch(path))
+                else:
+                    changed.add(path)
+
+        return changed
+
+    def close(self):
+        """Stop watching."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """Finds the files that appear in a directory tree by checking which
+    directories have changed.
+
+    Adding, removing or renaming a file changes the modification time of its
+    directory, so only the directories that changed are listed again. This is
+    used where inotify isn't available, e.g. on network file systems.
+    """
+
+    def __init__(
+        self,
+        root: str | os.PathLike,
+        recursive: bool = True,
+        exclude: Iterable[str] | None = None,
+        prune: Iterable[str | os.PathLike] = (),
+        interval: float = POLL_INTERVAL,
+    ):
+        """Start watching a directory tree.
+
+        Args:
+            root: The top of the tree
+            recursive: Whether to watch subdirectories too
+            exclude: Shell-style patterns of directory names not to watch
+            prune: Directories not to watch
+            interval: The seconds between checks for changed directories
+        """
+        self.root = os.fspath(root)
+        self.recursive = recursive
+        self.interval = interval
+        self._exclude = walker.compile_patterns(exclude)
+        self._pruned = _identities(prune)
+
+        # The modification time of each directory, by path
+        self._mtimes: Dict[str, int] = dict()
+        self._listed: Dict[str, Set[str]] = dict()
+
+        self._watch(self.root)
+        self._next_check = time.monotonic() + interval
+
+    def _watch(self, top: str) -> Set[str]:
+        found = set()
+
+        for directory in _directories(top, self.recursive, self._exclude, self._pruned):
+            if directory in self._mtimes:
+                continue
+
+            try:
+                self._mtimes[directory] = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+
+            self._listed[directory] = set(_files(directory))
+            found.update(self._listed[directory])
+
+        return found
+
+    def changes(self, timeout: float | None) -> Set[str]:
+        """Wait for files to appear.
+
+        Args:
+            timeout: The longest time to wait, in seconds. Waits for changes
+                however long it takes if None.
+
+        Returns:
+            The paths of the files that were created or moved into the tree
+            since the last check, if any
+        """
+        while True:
+            wait = max(self._next_check - time.monotonic(), 0)
+            if timeout is not None and timeout < wait:
+                time.sleep(timeout)
+                return set()
+
+            time.sleep(wait)
+            self._next_check = time.monotonic() + self.interval
+
+            changed = self._check()
+            if changed or timeout is not None:
+                return changed
+
+    def _check(self) -> Set[str]:
+        changed = set()
+
+        for directory, mtime in list(self._mtimes.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                del self._mtimes[directory]
+                del self._listed[directory]
+                continue
+
+            if current == mtime:
+                continue
+            self._mtimes[directory] = current
+
+            files = set(_files(directory))
+            changed.update(files - self._listed[directory])
+            self._listed[directory] = files
+
+            if self.recursive:
+                changed.update(self._watch(directory))
+
+        return changed
+
+    def close(self):
+        """Stop watching."""
+
+
+def _identities(paths: Iterable[str | os.PathLike]) -> Set[Tuple[int, int]]:
+    identities = set()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            identities.add((st.st_dev, st.st_ino))
+        except OSError:
+            pass
+
+    return identities
+
+
+def _directories(top: str, recursive: bool, exclude, pruned) -> Iterable[str]:
+    pending = [top]
+    while pending:
+        directory = pending.pop()
+        yield directory
+
+        if not recursive:
+            return
+
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if exclude and exclude.match(entry.name):
+                        continue
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+
+                    st = entry.stat(follow_symlinks=False)
+                    if (st.st_dev, st.st_ino) not in pruned:
+                        pending.append(entry.path)
+        except OSError as err:
+            logging.warning("Skipping directory %s: %s", directory, err)
+
+
+def _files(directory: str) -> List[str]:
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.path for entry in entries if entry.is_file()]
+    except OSError:
+        return list()
+
+
+def _all_files(directories: Iterable[str]) -> Set[str]:
+    return {path for directory in list(directories) for path in _files(directory)}
+
+
+def watch(
+    source: Path,
+    out: Path,
+    debounce: float = DEBOUNCE,
+    poll_interval: float = POLL_INTERVAL,
+    polling: bool = False,
+    copy_workers: int = transfer.DEFAULT_COPY_WORKERS,
+    stop: threading.Event | None = None,
+    progress: Progress | None = None,
+    output: str = "move",
+    **options,
+):
+    """Keep a directory sorted, sorting photos as they arrive.
+
+    The photos already in ``source`` are sorted first. Then the directory tree
+    is watched with inotify, so new photos are sorted within seconds while
+    nothing is done in between. Where inotify isn't available, directories are
+    checked for changes every ``poll_interval`` seconds instead.
+
+    Files are only sorted once their size and modification time have stayed
+    the same for ``debounce`` seconds, so files that are still being copied in
+    aren't moved half-written. Files that can't be sorted are left where they
+    are, and aren't looked at again unless they change.
+
+    The sorted tree is only scanned once, when watching starts, so nothing but
+    this should change ``out`` while watching.
+
+    Args:
+        source: The directory to keep sorted
+        out: The out directory to put the sorted file tree
+        debounce: The seconds a new file must stay the same before it is sorted
+        poll_interval: The seconds between checks for changes when polling
+        polling: Whether to poll for changes even if inotify is available
+        copy_workers: See ``disk_sorter.execute_plan``
+        stop: Watching stops once this is set. Watches until interrupted if
+            None.
+        progress: Tracks how sorting is going. If None, a summary is logged
+            once watching stops.
+        output: How files are put into the sorted tree. See
+            ``disk_sorter.move_photos``.
+        options: Passed on to ``disk_sorter.plan_moves``, which describes them
+    """
+    stop = stop or threading.Event()
+    summarise = progress is None
+    progress = progress or Progress()
+
+    watcher_options = dict(
+        recursive=options.get("recursive", True),
+        exclude=options.get("exclude"),
+        prune=[out],
+    )
+
+    watcher = None
+    if not polling:
+        try:
+            watcher = InotifyWatcher(source, **watcher_options)
+        except OSError as err:
+            logging.warning("Polling for changes, since inotify failed: %s", err)
+    if watcher is None:
+        watcher = PollingWatcher(source, interval=poll_interval, **watcher_options)
+
+    # The size and modification time of files seen, and when that last changed,
+    # by path
+    pending: Dict[str, Tuple[tuple, float]] = dict()
+
+    # The size and modification time of files that were looked at but left
+    # where they are, by path
+    handled: Dict[str, tuple] = dict()
+
+    # The sorted tree as planned, and as it actually is. These differ only
+    # while a batch is being sorted, or when a planned move failed.
+    planned = DestinationIndex(out)
+    sorted_tree = DestinationIndex(out)
+
+    def sort(files=None):
+        moves = disk_sorter.plan_moves(
+            source,
+            out,
+            files=files,
+            deduplicator=deduplicator,
+            progress=progress,
+            index=planned,
+            **options,
+        )
+        disk_sorter.execute_plan(
+            moves,
+            out,
+            copy_workers=copy_workers,
+            deduplicator=deduplicator,
+            progress=progress,
+            output=output,
+            index=sorted_tree,
+        )
+
+    def prune():
+        for path in [path for path in handled if not os.path.exists(path)]:
+            del handled[path]
+        deduplicator.prune()
+
+    try:
+        with Deduplicator() as deduplicator:
+            # Files arriving meanwhile are reported by the watcher, which was
+            # started first so that none are missed
+            sort()
+            logging.info("Watching %s for new photos", source)
+            last_prune = time.monotonic()
+
+            while not stop.is_set():
+                if time.monotonic() - last_prune > PRUNE_INTERVAL:
+                    prune()
+                    last_prune = time.monotonic()
+
+                timeout = debounce / 2 if pending else None
+                if timeout is None or timeout > WAKE_INTERVAL:
+                    timeout = WAKE_INTERVAL
+
+                for path in watcher.changes(timeout):
+                    pending.setdefault(path, (None, 0.0))
+
+                ready = _settled(pending, handled, debounce)
+                if not ready:
+                    continue
+
+                logging.debug("Sorting %s new files", len(ready))
+                sort(ready)
+
+                for path in ready:
+                    if os.path.exists(path):
+                        handled[path] = _signature(path)
+                    else:
+                        handled.pop(path, None)
+    finally:
+        watcher.close()
+        if summarise:
+            progress.summary()
+
+
+def _signature(path: str) -> tuple | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _settled(
+    pending: Dict[str, Tuple[tuple, float]],
+    handled: Dict[str, tuple],
+    debounce: float,
+) -> List[str]:
+    # Finds the pending files which haven't changed for long enough, removing
+    # them from those pending
+    now = time.monotonic()
+    ready = list()
+
+    for path, (signature, since) in list(pending.items()):
+        current = _signature(path)
+
+        if current is None or handled.get(path) == current:
+            # Gone, or already looked at and unchanged since
+            del pending[path]
+        elif current != signature:
+            pending[path] = (current, now)
+        elif now - since >= debounce:
+            del pending[path]
+            ready.append(path)
+
+    return ready